@@ -0,0 +1,118 @@
+"""
+Compare the stdlib csv loader in update_card_db.py against the old pandas path.
+
+Each run loads ultraman_cards.csv into a fresh database in its own Python
+process, so interpreter start-up, module imports and peak RSS (ru_maxrss)
+are included as the daily sync would see them. The pandas path (read_csv +
+to_sql, as update_card_db.py did before) is skipped if pandas is not
+installed.
+
+    python benchmarks/ingest_csv_vs_pandas.py [--csv ultraman_cards.csv] [--repeat 5] [--json]
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def load_csv_module(csv_file, db_file):
+    import sqlite3
+    import update_card_db
+    conn = sqlite3.connect(db_file)
+    conn.execute(f"CREATE TABLE cards ({update_card_db.CARD_COLUMNS})")
+    columns, rows = update_card_db.load_csv(csv_file)
+    count = update_card_db.insert_rows(conn, "cards", columns, rows)
+    conn.commit()
+    conn.close()
+    return count
+
+
+def load_pandas(csv_file, db_file):
+    import sqlite3
+    import pandas as pd
+    import update_card_db
+    conn = sqlite3.connect(db_file)
+    conn.execute(f"CREATE TABLE cards ({update_card_db.CARD_COLUMNS})")
+    df = pd.read_csv(csv_file)
+    for col in ["level", "round"]:
+        df[col] = df[col].astype("Int64")
+    df.to_sql("cards", conn, if_exists="append", index=False)
+    conn.commit()
+    conn.close()
+    return len(df)
+
+
+LOADERS = {"csv": load_csv_module, "pandas": load_pandas}
+
+
+def child(loader, csv_file):
+    """Runs inside the measured process: load once, report time and peak RSS."""
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp:
+        rows = LOADERS[loader](csv_file, os.path.join(tmp, "cards.db"))
+    elapsed = time.perf_counter() - start
+    print(json.dumps({"rows": rows, "load_ms": elapsed * 1000,
+                      "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+
+
+def measure(loader, csv_file, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = subprocess.run(
+            [sys.executable, __file__, "--child", loader, "--csv", csv_file],
+            cwd=ROOT, check=True, capture_output=True, text=True,
+        ).stdout
+        sample = json.loads(out.splitlines()[-1])
+        sample["process_ms"] = (time.perf_counter() - start) * 1000
+        samples.append(sample)
+    return {
+        "rows": samples[0]["rows"],
+        "process_ms": statistics.median(s["process_ms"] for s in samples),
+        "load_ms": statistics.median(s["load_ms"] for s in samples),
+        "peak_rss_mib": max(s["peak_rss_mib"] for s in samples),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--csv", default=str(ROOT / "ultraman_cards.csv"))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    parser.add_argument("--child", choices=LOADERS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        sys.path.insert(0, str(ROOT))
+        child(args.child, args.csv)
+        return
+
+    results = {}
+    for loader in LOADERS:
+        if loader == "pandas":
+            try:
+                import pandas  # pylint: disable=import-outside-toplevel,unused-import
+            except ImportError:
+                print("pandas not installed; skipping the pandas loader", file=sys.stderr)
+                continue
+        results[loader] = measure(loader, args.csv, args.repeat)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'loader':<10}{'rows':>8}{'process ms':>12}{'load ms':>10}{'peak RSS MiB':>14}")
+    for loader, result in results.items():
+        print(f"{loader:<10}{result['rows']:>8}{result['process_ms']:>12.1f}{result['load_ms']:>10.1f}{result['peak_rss_mib']:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+Load test the API under a real ASGI server.
+
+Starts nebula_api under uvicorn and/or hypercorn on a local port and replays
+a mix of requests built from the contents of ultraman_cards.db: /cards filter
+combinations, /card/{number} lookups, /search terms and /stats. Each
+endpoint is first driven on its own and then all together in the mix;
+every phase reports throughput, p50/p95/p99 latency, error count, response
+bytes and the server's resident memory.
+
+Results can be written as JSON and compared with an earlier run, which
+exits non-zero when a phase regressed beyond the allowed threshold:
+
+    python benchmarks/load_test.py --server uvicorn --duration 10 --json out.json
+    python benchmarks/load_test.py --compare baseline.json --json out.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from urllib.parse import quote
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+
+SERVERS = {
+    "uvicorn": lambda port: [sys.executable, "-m", "uvicorn", "nebula_api:app", "--host", "127.0.0.1",
+                             "--port", str(port), "--log-level", "warning", "--no-access-log"],
+    "hypercorn": lambda port: [sys.executable, "-m", "hypercorn", "nebula_api:app",
+                               "--bind", f"127.0.0.1:{port}", "--log-level", "warning"],
+}
+
+# Share of each endpoint in the mixed phase
+MIX = {"cards": 0.5, "card": 0.25, "search": 0.15, "stats": 0.10}
+
+
+# ======================================================
+# Workload
+# ======================================================
+def build_workload(db_path, seed):
+    """Request paths per endpoint, drawn from the card data."""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+
+    def distinct(column):
+        return [r[0] for r in conn.execute(f"SELECT DISTINCT {column} FROM cards WHERE {column} IS NOT NULL")]
+
+    rarities, features, types = distinct("rarity"), distinct("feature"), distinct("type")
+    characters = [c for c in distinct("character_name") if c != "-"]
+    years, levels = distinct("publication_year"), distinct("level")
+    # numbers containing "/" (e.g. "AP(01/20) BP01-001") cannot be path segments
+    numbers = [n for n in distinct("number") if "/" not in n]
+    names = distinct("name")
+    conn.close()
+
+    words = sorted({w for name in names for w in name.split() if len(w) >= 3})
+    cards = []
+    for _ in range(200):
+        params = {}
+        for key, values in (("rarity", rarities), ("feature", features), ("type", types),
+                            ("character_name", characters), ("publication_year", years), ("level", levels)):
+            if rng.random() < 0.3:
+                params[key] = rng.choice(values)
+        if rng.random() < 0.5:
+            params["limit"] = rng.choice([10, 25, 50, 100])
+        cards.append("/cards" + ("?" + str(httpx.QueryParams(params)) if params else ""))
+
+    return {
+        "cards": cards,
+        "card": [f"/card/{quote(rng.choice(numbers))}" for _ in range(200)],
+        "search": [f"/search?{httpx.QueryParams({'q': rng.choice(words)[:rng.randint(3, 8)], 'limit': 20})}" for _ in range(200)],
+        "stats": ["/stats"],
+    }
+
+
+# ======================================================
+# Server
+# ======================================================
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_mib(pid):
+    """
+    Resident memory of ``pid`` and its child processes (servers may run the
+    app in a worker process), from Linux /proc; None elsewhere.
+    """
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            rss = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:")) / 1024
+        children = []
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children", encoding="ascii") as f:
+                children += f.read().split()
+    except (OSError, StopIteration):
+        return None
+    return rss + sum(rss_mib(int(child)) or 0 for child in children)
+
+
+def start_server(name, port, env):
+    proc = subprocess.Popen(SERVERS[name](port), cwd=ROOT, env={**os.environ, **env})
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/", timeout=1).status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    proc.kill()
+    raise SystemExit(f"{name} did not start on port {port}")
+
+
+# ======================================================
+# Load generation
+# ======================================================
+def percentile(sorted_samples, pct):
+    if not sorted_samples:
+        return None
+    return sorted_samples[min(len(sorted_samples) - 1, int(round(pct / 100 * (len(sorted_samples) - 1))))]
+
+
+async def run_phase(base_url, paths, duration, concurrency, seed):
+    """Request random picks from ``paths`` with ``concurrency`` clients for ``duration`` seconds."""
+    rng = random.Random(seed)
+    latencies = []
+    errors = 0
+    body_bytes = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(client):
+        nonlocal errors, body_bytes
+        while time.perf_counter() < deadline:
+            path = rng.choice(paths)
+            start = time.perf_counter()
+            try:
+                response = await client.get(path)
+                ok = response.status_code == 200
+                body_bytes += len(response.content)
+            except httpx.HTTPError:
+                ok = False
+            latencies.append((time.perf_counter() - start) * 1000)
+            errors += not ok
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "mean_ms": round(statistics.fmean(latencies), 3),
+        "bytes_per_request": round(body_bytes / len(latencies)) if latencies else 0,
+    }
+
+
+def run_server(name, workload, args):
+    port = free_port()
+    env = {"NEBULA_ENGINE": args.engine}
+    if args.no_response_cache:
+        env["NEBULA_RESPONSE_CACHE_BYTES"] = "0"
+    proc = start_server(name, port, env)
+    base_url = f"http://127.0.0.1:{port}"
+    phases = {}
+    try:
+        result = {"rss_start_mib": rss_mib(proc.pid), "phases": phases}
+        rng = random.Random(args.seed)
+        mixed = [rng.choice(workload[e]) for e in rng.choices(list(MIX), weights=list(MIX.values()), k=1000)]
+        plan = [(endpoint, workload[endpoint]) for endpoint in MIX] + [("mixed", mixed)]
+        for i, (phase, paths) in enumerate(plan):
+            stats = asyncio.run(run_phase(base_url, paths, args.duration, args.concurrency, args.seed + i))
+            stats["rss_mib"] = rss_mib(proc.pid)
+            phases[phase] = stats
+            print(f"{name:<10}{phase:<8}{stats['requests']:>9}{stats['errors']:>7}{stats['rps']:>10.1f}"
+                  f"{stats['p50_ms']:>9.2f}{stats['p95_ms']:>9.2f}{stats['p99_ms']:>9.2f}"
+                  f"{stats['rss_mib'] or 0:>9.1f}", file=sys.stderr)
+        return result
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def compare(baseline, current, threshold):
+    """Print per-phase deltas; returns the regressions beyond ``threshold``."""
+    regressions = []
+    for server, result in current["servers"].items():
+        base_phases = baseline.get("servers", {}).get(server, {}).get("phases", {})
+        for phase, stats in result["phases"].items():
+            base = base_phases.get(phase)
+            if not base:
+                continue
+            for metric, worse_if_higher in (("rps", False), ("p95_ms", True), ("p99_ms", True)):
+                before, after = base[metric], stats[metric]
+                if not before:
+                    continue
+                change = (after - before) / before
+                print(f"{server:<10}{phase:<8}{metric:<8}{before:>10.2f}{after:>10.2f}{change:>+9.1%}")
+                if (change > threshold) if worse_if_higher else (change < -threshold):
+                    regressions.append(f"{server} {phase} {metric} {change:+.1%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--server", choices=[*SERVERS, "all"], default="all")
+    parser.add_argument("--engine", choices=["sqlite", "memory"], default="sqlite")
+    parser.add_argument("--db", default=str(ROOT / "ultraman_cards.db"), help="database to draw the workload from")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per phase")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=901)
+    parser.add_argument("--no-response-cache", action="store_true", help="measure with the response cache disabled")
+    parser.add_argument("--json", metavar="PATH", help="write results as JSON")
+    parser.add_argument("--compare", metavar="PATH", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed relative regression for --compare")
+    args = parser.parse_args()
+
+    workload = build_workload(args.db, args.seed)
+    servers = list(SERVERS) if args.server == "all" else [args.server]
+    print(f"{'server':<10}{'phase':<8}{'requests':>9}{'errors':>7}{'req/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'RSS MiB':>9}",
+          file=sys.stderr)
+    results = {
+        "config": {k: getattr(args, k) for k in ("engine", "duration", "concurrency", "seed", "no_response_cache")},
+        "python": sys.version.split()[0],
+        "servers": {name: run_server(name, workload, args) for name in servers},
+    }
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+
+    if args.compare:
+        regressions = compare(json.loads(Path(args.compare).read_text(encoding="utf-8")), results, args.threshold)
+        if regressions:
+            print("Regressions: " + "; ".join(regressions), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Compare the FTS5 /search path against the original LIKE '%q%' scan.
+
+Runs both queries directly against ultraman_cards.db (no HTTP) for a set of
+search terms taken from the card data, and prints per-term and overall
+timings. Both queries fetch at most ``--limit`` rows (all with
+``--limit 0``), so the comparison measures the index, not result
+truncation. Requires a database built by update_card_db.py (with cards_fts).
+
+    python benchmarks/search_fts_vs_like.py [--db ultraman_cards.db] [--repeat 200] [--json]
+"""
+import argparse
+import json
+import sqlite3
+import statistics
+import time
+from pathlib import Path
+
+LIKE_SQL = """
+    SELECT * FROM cards
+    WHERE name LIKE ? OR effect LIKE ? OR flavor_text LIKE ?
+    ORDER BY id
+    LIMIT ?
+"""
+FTS_SQL = """
+    SELECT cards.* FROM cards_fts
+    JOIN cards ON cards.id = cards_fts.rowid
+    WHERE cards_fts MATCH ?
+    ORDER BY bm25(cards_fts, 10.0, 5.0, 1.0, 1.0), cards.id
+    LIMIT ?
+"""
+# Type-ahead style prefixes plus full words and phrases seen in effect text
+TERMS = ["Gai", "Gaia", "Ultraman", "Zet", "Zetton", "attack", "draw two cards",
+         "level up", "Kaiju", "BP", "hand", "Belial", "opponent's"]
+
+
+def time_query(conn, sql, params, repeat):
+    samples = []
+    rows = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = len(conn.execute(sql, params).fetchall())
+        samples.append((time.perf_counter() - start) * 1000)
+    return {"rows": rows, "median_ms": statistics.median(samples), "p95_ms": sorted(samples)[int(0.95 * (len(samples) - 1))]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--db", default=str(Path(__file__).resolve().parent.parent / "ultraman_cards.db"))
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=50,
+                        help="result limit of both queries, as a type-ahead UI would use; 0 for no limit")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'cards_fts'").fetchone() is None:
+        raise SystemExit("cards_fts not found; rebuild the database with update_card_db.py")
+
+    limit = args.limit or -1  # LIMIT -1: no limit
+    results = []
+    for term in TERMS:
+        like = f"%{term}%"
+        phrase = '"' + term.replace('"', '""') + '"'
+        results.append({
+            "term": term,
+            "like": time_query(conn, LIKE_SQL, (like, like, like, limit), args.repeat),
+            "fts": time_query(conn, FTS_SQL, (phrase, limit), args.repeat) if len(term) >= 3 else None,
+        })
+    conn.close()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'term':<16}{'LIKE rows':>10}{'LIKE ms':>10}{'FTS rows':>10}{'FTS ms':>10}{'speedup':>9}")
+    for result in results:
+        like, fts = result["like"], result["fts"]
+        if fts is None:
+            print(f"{result['term']:<16}{like['rows']:>10}{like['median_ms']:>10.3f}{'-':>10}{'-':>10}{'-':>9}")
+            continue
+        speedup = like["median_ms"] / fts["median_ms"] if fts["median_ms"] else float("inf")
+        print(f"{result['term']:<16}{like['rows']:>10}{like['median_ms']:>10.3f}{fts['rows']:>10}{fts['median_ms']:>10.3f}{speedup:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
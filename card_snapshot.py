@@ -0,0 +1,214 @@
+"""
+Memory-mapped binary snapshot of the ``cards`` table.
+
+update_card_db.py writes ``ultraman_cards.snap`` next to the database on
+every sync.  With ``NEBULA_ENGINE=memory`` each worker maps it read-only
+instead of loading the table, so the card data sits once in the page cache
+however many workers run, and loading a new data version is an ``mmap`` and
+a small header parse.
+
+Layout (native byte order, recorded in the directory; sections 8-byte
+aligned and addressed relative to the end of the directory):
+
+    header       MAGIC, FORMAT_VERSION, directory length (``HEADER``)
+    directory    JSON: data version, row count, per column its kind and
+                 section offsets
+    int column   one int64 per row, ``NULL_INT`` for NULL
+    dict column  one uint32 code per row; per distinct value a type tag
+                 (uint8) and its start offset in the heap (uint32, plus a
+                 final end offset); the heap of UTF-8 encoded values
+
+Mapped columns are the same ``IntColumn`` / ``DictColumn`` types that
+``CardStore.from_sqlite`` builds, over ``memoryview``s of the mapping:
+values are decoded when read, and the per-value bitmaps of a text column
+are built on its first filter.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Any, Iterator, Optional, Sequence
+
+from card_store import CardStore, DictColumn, IntColumn, bitmap_from_positions
+
+MAGIC = b"NEBSNAP\0"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sII")  # magic, format version, directory length
+
+# Type tags of dictionary values
+TAG_NULL, TAG_STR, TAG_INT, TAG_FLOAT = range(4)
+TAGS = {type(None): TAG_NULL, str: TAG_STR, int: TAG_INT, float: TAG_FLOAT}
+
+
+def snapshot_path(db_file) -> str:
+    """The snapshot file kept next to ``db_file``."""
+    return os.path.splitext(str(db_file))[0] + ".snap"
+
+
+# ======================================================
+# Mapped columns
+# ======================================================
+class ValueHeap(Sequence):
+    """Distinct values of a mapped text column, decoded from the heap on access."""
+
+    def __init__(self, tags, offsets, heap):
+        self.tags = tags
+        self.offsets = offsets
+        self.heap = heap
+
+    def __len__(self):
+        return len(self.tags)
+
+    def __getitem__(self, code: int) -> Any:
+        tag = self.tags[code]
+        if tag == TAG_NULL:
+            return None
+        text = str(self.heap[self.offsets[code]:self.offsets[code + 1]], "utf-8")
+        return text if tag == TAG_STR else int(text) if tag == TAG_INT else float(text)
+
+    def __iter__(self) -> Iterator[Any]:
+        return map(self.__getitem__, range(len(self)))
+
+
+class MappedDictColumn(DictColumn):
+    """``DictColumn`` over mapped codes; the value bitmaps are built on first use."""
+
+    def __init__(self, codes, dictionary: ValueHeap):
+        self._postings = None
+        super().__init__(codes, dictionary, None)
+
+    @property
+    def postings(self):
+        if self._postings is None:
+            positions = [[] for _ in range(len(self.dictionary))]
+            for pos, code in enumerate(self.codes):
+                positions[code].append(pos)
+            self._postings = [bitmap_from_positions(p) for p in positions]
+        return self._postings
+
+    @postings.setter
+    def postings(self, value):
+        self._postings = value
+
+
+# ======================================================
+# Writing
+# ======================================================
+def write_snapshot(store: CardStore, path, data_version: str):
+    """Serialize ``store`` to ``path`` (temporary file + atomic rename)."""
+    body = bytearray()
+
+    def section(data) -> int:
+        body.extend(b"\0" * (-len(body) % 8))
+        start = len(body)
+        body.extend(data)
+        return start
+
+    columns = []
+    for name in store.column_names:
+        column = store.columns[name]
+        if isinstance(column, IntColumn):
+            columns.append({"name": name, "kind": "int", "values": section(array("q", column.values).tobytes())})
+            continue
+        tags, offsets, heap = array("B"), array("I", [0]), bytearray()
+        for value in column.dictionary:
+            tags.append(TAGS[type(value)])
+            if value is not None:
+                heap.extend((value if isinstance(value, str) else repr(value)).encode("utf-8"))
+            offsets.append(len(heap))
+        columns.append({
+            "name": name,
+            "kind": "dict",
+            "codes": section(array("I", column.codes).tobytes()),
+            "distinct": len(tags),
+            "tags": section(tags.tobytes()),
+            "offsets": section(offsets.tobytes()),
+            "heap": section(heap),
+            "heap_bytes": len(heap),
+        })
+
+    directory = json.dumps({
+        "data_version": data_version,
+        "byteorder": sys.byteorder,
+        "rows": store.size,
+        "columns": columns,
+    }).encode("utf-8")
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(directory)))
+        f.write(directory)
+        f.write(b"\0" * (-(HEADER.size + len(directory)) % 8))
+        f.write(body)
+    os.replace(tmp, path)
+
+
+# ======================================================
+# Reading
+# ======================================================
+def read_directory(mapped) -> Optional[dict]:
+    """The directory of a mapped snapshot, None when it is not one this code reads."""
+    try:
+        magic, version, length = HEADER.unpack_from(mapped)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            return None
+        directory = json.loads(mapped[HEADER.size:HEADER.size + length])
+    except (struct.error, ValueError):
+        return None
+    if directory.get("byteorder") != sys.byteorder:
+        return None
+    directory["base"] = HEADER.size + length + (-(HEADER.size + length) % 8)
+    return directory
+
+
+def snapshot_version(path) -> Optional[str]:
+    """Data version of the snapshot at ``path``, None if missing or unreadable."""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(HEADER.size)
+            try:
+                _, _, length = HEADER.unpack(head)
+            except struct.error:
+                return None
+            directory = read_directory(head + f.read(length))
+    except FileNotFoundError:
+        return None
+    return directory and directory["data_version"]
+
+
+def open_snapshot(path, data_version: Optional[str] = None) -> Optional[CardStore]:
+    """
+    ``CardStore`` over the snapshot at ``path`` mapped read-only; None when
+    it is missing, of another format, or not of ``data_version``.
+    """
+    try:
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        return None
+    directory = read_directory(mapped)
+    if directory is None or (data_version is not None and directory["data_version"] != data_version):
+        mapped.close()
+        return None
+
+    view = memoryview(mapped)
+    base, rows = directory["base"], directory["rows"]
+
+    def section(offset: int, length: int, fmt: str):
+        start = base + offset
+        return view[start:start + length * struct.calcsize(fmt)].cast(fmt)
+
+    columns = {}
+    for column in directory["columns"]:
+        if column["kind"] == "int":
+            columns[column["name"]] = IntColumn(section(column["values"], rows, "q"))
+        else:
+            distinct = column["distinct"]
+            heap = ValueHeap(
+                section(column["tags"], distinct, "B"),
+                section(column["offsets"], distinct + 1, "I"),
+                section(column["heap"], column["heap_bytes"], "B"),
+            )
+            columns[column["name"]] = MappedDictColumn(section(column["codes"], rows, "I"), heap)
+    return CardStore([column["name"] for column in directory["columns"]], columns)
@@ -0,0 +1,91 @@
+"""
+Aggregate statistics served by ``GET /stats``.
+
+The card data only changes when ``update_card_db.py`` runs, so the sync
+script computes the payload once and stores it, pre-encoded, in the
+``stats`` table together with a strong ETag.  The API serves those bytes
+as-is and only falls back to ``compute_stats`` for databases built before
+the table existed.
+"""
+import hashlib
+import json
+import sqlite3
+from typing import Any, Dict, Optional, Tuple
+
+BATTLE_POWER_COLUMNS = ["battle_power_1", "battle_power_2", "battle_power_3", "battle_power_4", "battle_power_ex"]
+BATTLE_POWER_BUCKET = 1000
+
+
+def compute_stats(conn: sqlite3.Connection) -> Dict[str, Any]:
+    """Run the aggregate queries behind /stats."""
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT COUNT(*) FROM cards")
+    total = cursor.fetchone()[0]
+
+    cursor.execute("SELECT rarity, COUNT(*) FROM cards GROUP BY rarity")
+    rarity_counts = {r: c for r, c in cursor.fetchall()}
+
+    cursor.execute("SELECT feature, COUNT(*) FROM cards GROUP BY feature")
+    feature_counts = {r: c for r, c in cursor.fetchall()}
+
+    cursor.execute("SELECT type, COUNT(*) FROM cards WHERE type IS NOT NULL GROUP BY type")
+    type_counts = {r: c for r, c in cursor.fetchall()}
+
+    cursor.execute("SELECT publication_year, COUNT(*) FROM cards WHERE publication_year IS NOT NULL GROUP BY publication_year ORDER BY publication_year ASC")
+    year_counts = {r: c for r, c in cursor.fetchall()}
+
+    cursor.execute("SELECT character_name, COUNT(*) FROM cards WHERE character_name <> '-' AND feature = 'Ultra Hero' GROUP BY character_name ORDER BY COUNT(*) DESC LIMIT 25")
+    top_ultras = {r: c for r, c in cursor.fetchall()}
+
+    cursor.execute("SELECT character_name, COUNT(*) FROM cards WHERE character_name <> '-' AND feature = 'Kaiju' GROUP BY character_name ORDER BY COUNT(*) DESC LIMIT 25")
+    top_kaiju = {r: c for r, c in cursor.fetchall()}
+
+    cursor.execute("SELECT display_card_bundle_names, COUNT(*) FROM cards WHERE display_card_bundle_names IS NOT NULL GROUP BY display_card_bundle_names")
+    set_counts = {r: c for r, c in cursor.fetchall()}
+
+    cursor.execute("SELECT illustrator_name, COUNT(*) FROM cards WHERE illustrator_name IS NOT NULL GROUP BY illustrator_name ORDER BY COUNT(*) DESC, illustrator_name ASC")
+    illustrator_counts = {r: c for r, c in cursor.fetchall()}
+
+    battle_power_histograms = {}
+    for column in BATTLE_POWER_COLUMNS:
+        cursor.execute(f"SELECT ({column} / ?) * ?, COUNT(*) FROM cards WHERE {column} IS NOT NULL GROUP BY 1 ORDER BY 1 ASC", (BATTLE_POWER_BUCKET, BATTLE_POWER_BUCKET))
+        battle_power_histograms[column] = {r: c for r, c in cursor.fetchall()}
+
+    return {
+        "total_cards": total,
+        "rarity_distribution": rarity_counts,
+        "feature_distribution": feature_counts,
+        "type_distribution": type_counts,
+        "publication_year_distribution": year_counts,
+        "top_25_ultras": top_ultras,
+        "top_25_kaiju": top_kaiju,
+        "set_distribution": set_counts,
+        "illustrator_distribution": illustrator_counts,
+        "battle_power_histograms": battle_power_histograms,
+    }
+
+
+def encode_stats(stats: Dict[str, Any]) -> Tuple[bytes, str]:
+    """Serialize a stats payload and derive its strong ETag from the bytes."""
+    body = json.dumps(stats, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return body, '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def write_stats_table(conn: sqlite3.Connection):
+    """(Re)build the single-row ``stats`` table from the current cards."""
+    body, etag = encode_stats(compute_stats(conn))
+    conn.execute("DROP TABLE IF EXISTS stats")
+    conn.execute("CREATE TABLE stats (name TEXT PRIMARY KEY, payload TEXT NOT NULL, etag TEXT NOT NULL)")
+    conn.execute("INSERT INTO stats (name, payload, etag) VALUES ('stats', ?, ?)", (body.decode("utf-8"), etag))
+
+
+def read_stats_table(conn: sqlite3.Connection) -> Optional[Tuple[bytes, str]]:
+    """Return the precomputed (payload, etag), or None if the table is missing."""
+    try:
+        row = conn.execute("SELECT payload, etag FROM stats WHERE name = 'stats'").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    if row is None:
+        return None
+    return row[0].encode("utf-8"), row[1]
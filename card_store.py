@@ -0,0 +1,451 @@
+"""
+In-memory, column-oriented snapshot of the ``cards`` table.
+
+The whole card pool is small (~1.2k rows), so instead of opening a SQLite
+connection per request the API can load the table once and answer the
+``/cards``, ``/card/{number}`` and ``/search`` queries from memory.  Rows
+are kept in ``id`` order (the order SQLite returns them in) and every filter
+evaluates to a *bitmap*: a Python ``int`` whose bit ``i`` is set when row
+``i`` matches.  Filters combine with ``&``/``|`` and counts are
+``int.bit_count()``.
+
+Columns come in two flavours:
+
+* ``IntColumn`` - every non-NULL value is an integer; stored in an
+  ``array('q')`` with ``NULL_INT`` marking NULL.  Range filters bisect its
+  sorted distinct values, each paired with the bitmap of rows at or below it.
+* ``DictColumn`` - anything else (text); dictionary-encoded into an
+  ``array('I')`` of codes plus the list of distinct values, with one bitmap
+  per distinct value so predicates only run once per distinct value.
+
+Matching follows SQLite semantics so both engines return the same rows:
+``LIKE`` is case-insensitive for ASCII only, ``%``/``_`` are wildcards and
+NULL never matches.
+"""
+import re
+import sqlite3
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import islice
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+NULL_INT = -(2 ** 63)
+
+
+# ======================================================
+# Bitmap helpers
+# ======================================================
+def bitmap_from_positions(positions) -> int:
+    """Build a bitmap with the given row positions set."""
+    bits = bytearray()
+    for pos in positions:
+        byte = pos >> 3
+        if byte >= len(bits):
+            bits.extend(b"\x00" * (byte - len(bits) + 1))
+        bits[byte] |= 1 << (pos & 7)
+    return int.from_bytes(bits, "little")
+
+
+def iter_positions(bitmap: int) -> Iterator[int]:
+    """Yield the set row positions of ``bitmap`` in ascending order."""
+    while bitmap:
+        low = bitmap & -bitmap
+        yield low.bit_length() - 1
+        bitmap ^= low
+
+
+def like_matcher(pattern: str) -> Callable[[Any], bool]:
+    """Compile a SQLite ``LIKE`` pattern into a predicate over column values."""
+    regex = "".join(
+        ".*" if ch == "%" else "." if ch == "_" else re.escape(ch)
+        for ch in pattern
+    )
+    fullmatch = re.compile(regex, re.ASCII | re.IGNORECASE | re.DOTALL).fullmatch
+
+    def match(value):
+        if value is None:
+            return False
+        return fullmatch(value if isinstance(value, str) else str(value)) is not None
+
+    return match
+
+
+def nocase_matcher(text: str) -> Callable[[Any], bool]:
+    """Predicate for ``column = ? COLLATE NOCASE``."""
+    folded = _ascii_fold(text)
+    return lambda value: isinstance(value, str) and _ascii_fold(value) == folded
+
+
+def _ascii_fold(text: str) -> str:
+    return text.translate(_ASCII_LOWER)
+
+
+_ASCII_LOWER = {code: code + 32 for code in range(ord("A"), ord("Z") + 1)}
+
+
+# ======================================================
+# Columns
+# ======================================================
+class IntColumn:
+    """Integer column stored as ``array('q')`` with ``NULL_INT`` for NULL."""
+
+    def __init__(self, values):
+        self.values = values
+        self._index: Optional[Dict[int, int]] = None
+        self._sorted: Optional[Tuple[List[int], List[int]]] = None
+
+    @classmethod
+    def from_values(cls, values: List[Optional[int]]) -> "IntColumn":
+        return cls(array("q", (NULL_INT if v is None else v for v in values)))
+
+    def __len__(self):
+        return len(self.values)
+
+    def get(self, pos: int) -> Optional[int]:
+        value = self.values[pos]
+        return None if value == NULL_INT else value
+
+    def value_index(self) -> Dict[int, int]:
+        """Map each distinct non-NULL value to the bitmap of rows holding it."""
+        if self._index is None:
+            positions: Dict[int, List[int]] = {}
+            for pos, value in enumerate(self.values):
+                if value != NULL_INT:
+                    positions.setdefault(value, []).append(pos)
+            self._index = {v: bitmap_from_positions(p) for v, p in positions.items()}
+        return self._index
+
+    def equals(self, value: int) -> int:
+        return self.value_index().get(value, 0)
+
+    def sorted_index(self) -> Tuple[List[int], List[int]]:
+        """
+        The distinct non-NULL values in ascending order and, for each, the
+        bitmap of rows holding it or any smaller value.
+        """
+        if self._sorted is None:
+            index = self.value_index()
+            values = sorted(index)
+            cumulative, bitmap = [], 0
+            for value in values:
+                bitmap |= index[value]
+                cumulative.append(bitmap)
+            self._sorted = (values, cumulative)
+        return self._sorted
+
+    def between(self, low: Optional[int], high: Optional[int]) -> int:
+        """Rows with ``low <= value <= high`` (None: unbounded): two bisects and an AND NOT."""
+        values, cumulative = self.sorted_index()
+        lo = 0 if low is None else bisect_left(values, low)
+        hi = len(values) if high is None else bisect_right(values, high)
+        if lo >= hi:
+            return 0
+        return cumulative[hi - 1] & ~cumulative[lo - 1] if lo else cumulative[hi - 1]
+
+    def where(self, predicate: Callable[[Any], bool]) -> int:
+        return _or_all(bm for v, bm in self.value_index().items() if predicate(v))
+
+    def counts(self, mask: int) -> Dict[int, int]:
+        """Per-value row counts restricted to ``mask`` (NULL excluded)."""
+        return {v: n for v, bm in self.value_index().items() if (n := (bm & mask).bit_count())}
+
+
+class DictColumn:
+    """Dictionary-encoded column: ``array('I')`` codes into ``dictionary``."""
+
+    def __init__(self, codes, dictionary: List[Any], postings: List[int]):
+        self.codes = codes
+        self.dictionary = dictionary
+        self.postings = postings
+        self._lookup: Optional[Dict[Any, int]] = None
+
+    @classmethod
+    def from_values(cls, values: List[Any]) -> "DictColumn":
+        lookup: Dict[Any, int] = {}
+        codes = array("I")
+        positions: List[List[int]] = []
+        for pos, value in enumerate(values):
+            code = lookup.get(value)
+            if code is None:
+                code = lookup[value] = len(positions)
+                positions.append([])
+            codes.append(code)
+            positions[code].append(pos)
+        dictionary = [None] * len(lookup)
+        for value, code in lookup.items():
+            dictionary[code] = value
+        return cls(codes, dictionary, [bitmap_from_positions(p) for p in positions])
+
+    def __len__(self):
+        return len(self.codes)
+
+    def get(self, pos: int) -> Any:
+        return self.dictionary[self.codes[pos]]
+
+    def equals(self, value: Any) -> int:
+        if self._lookup is None:
+            self._lookup = {v: code for code, v in enumerate(self.dictionary)}
+        code = self._lookup.get(value)
+        return 0 if code is None else self.postings[code]
+
+    def where(self, predicate: Callable[[Any], bool]) -> int:
+        return _or_all(
+            bm for value, bm in zip(self.dictionary, self.postings) if predicate(value)
+        )
+
+    def counts(self, mask: int) -> Dict[Any, int]:
+        """Per-value row counts restricted to ``mask`` (NULL included)."""
+        return {
+            value: n
+            for value, bm in zip(self.dictionary, self.postings)
+            if (n := (bm & mask).bit_count())
+        }
+
+
+def _or_all(bitmaps) -> int:
+    result = 0
+    for bm in bitmaps:
+        result |= bm
+    return result
+
+
+def _build_column(values: List[Any]):
+    if all(v is None or type(v) is int for v in values):
+        return IntColumn.from_values(values)
+    return DictColumn.from_values(values)
+
+
+# ======================================================
+# Sorting
+# ======================================================
+# Sortable columns and how SQL compares them: "int" keys are compared as
+# CAST(column AS INTEGER) (level/round are text such as "3.0" in databases
+# synced before they were stored as integers).
+SORT_KEYS = {
+    "id": "int",
+    "number": "text",
+    "level": "int",
+    "publication_year": "int",
+    "battle_power_1": "int",
+    "battle_power_2": "int",
+    "battle_power_3": "int",
+    "battle_power_4": "int",
+    "battle_power_ex": "int",
+}
+
+# NULL sort keys are replaced by these so NULLs come last in either direction
+SORT_NULL = {
+    ("int", False): 2 ** 63 - 1,
+    ("int", True): -(2 ** 63),
+    ("text", False): chr(0x10FFFF),
+    ("text", True): "",
+}
+
+_WHOLE_NUMBER = re.compile(r"([0-9]+)(?:\.0*)?")
+_LEADING_INT = re.compile(r"\s*([+-]?\d+)", re.ASCII)  # SQLite skips and reads ASCII only
+
+
+def sql_cast_int(value: Any) -> Optional[int]:
+    """Python equivalent of SQLite's ``CAST(value AS INTEGER)``."""
+    if value is None or type(value) is int:
+        return value
+    if isinstance(value, float):
+        return int(value)
+    match = _LEADING_INT.match(str(value))
+    return int(match.group(1)) if match else 0
+
+
+def whole_number(text: str) -> Optional[int]:
+    """``"3"``/``"3."``/``"3.0"`` -> 3, None for input that needs a prefix match."""
+    match = _WHOLE_NUMBER.fullmatch(text)
+    return int(match.group(1)) if match else None
+
+
+# ======================================================
+# Store
+# ======================================================
+class CardStore:
+    """Read-only columnar copy of the ``cards`` table."""
+
+    def __init__(self, column_names: List[str], columns: Dict[str, Any]):
+        self.column_names = column_names
+        self.columns = columns
+        self.size = len(columns["id"]) if column_names else 0
+        self.all_rows = (1 << self.size) - 1
+
+    @classmethod
+    def from_sqlite(cls, db_path) -> "CardStore":
+        conn = sqlite3.connect(db_path)
+        try:
+            return cls.from_connection(conn)
+        finally:
+            conn.close()
+
+    @classmethod
+    def from_connection(cls, conn: sqlite3.Connection) -> "CardStore":
+        cursor = conn.execute("SELECT * FROM cards ORDER BY id")
+        names = [d[0] for d in cursor.description]
+        rows = cursor.fetchall()
+        columns = {
+            name: _build_column([row[i] for row in rows])
+            for i, name in enumerate(names)
+        }
+        return cls(names, columns)
+
+    # ---------- row access ----------
+    def row(self, pos: int, columns: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        return {name: self.columns[name].get(pos) for name in columns or self.column_names}
+
+    def rows(
+        self,
+        bitmap: int,
+        limit: Optional[int] = None,
+        columns: Optional[Sequence[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Materialize matching rows (optionally only ``columns``) in id order."""
+        return list(self.rows_iter(bitmap, limit, columns))
+
+    def rows_iter(
+        self,
+        bitmap: int,
+        limit: Optional[int] = None,
+        columns: Optional[Sequence[str]] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        for pos in islice(iter_positions(bitmap), limit):
+            yield self.row(pos, columns)
+
+    # ---------- predicates ----------
+    def like(self, column: str, pattern: str) -> int:
+        return self.columns[column].where(like_matcher(pattern))
+
+    def equals_nocase(self, column: str, text: str) -> int:
+        return self.columns[column].where(nocase_matcher(text))
+
+    def equals(self, column: str, value: Any) -> int:
+        col = self.columns[column]
+        if isinstance(col, IntColumn):
+            return col.equals(value) if type(value) is int else 0
+        return col.equals(value)
+
+    def between(self, column: str, low: Optional[int], high: Optional[int]) -> int:
+        """Rows whose ``column`` is in [low, high], compared as ``CAST(column AS INTEGER)`` like SQL."""
+        col = self.columns[column]
+        if isinstance(col, IntColumn):
+            return col.between(low, high)
+        return col.where(lambda value: value is not None
+                         and (low is None or sql_cast_int(value) >= low)
+                         and (high is None or sql_cast_int(value) <= high))
+
+    # ---------- queries mirroring the SQL endpoints ----------
+    def filter_mask(
+        self,
+        name: Optional[str] = None,
+        rarity: Optional[str] = None,
+        level: Optional[str] = None,
+        round: Optional[str] = None,  # pylint: disable=redefined-builtin
+        character_name: Optional[str] = None,
+        feature: Optional[str] = None,
+        type: Optional[str] = None,  # pylint: disable=redefined-builtin
+        publication_year: Optional[int] = None,
+        number: Optional[str] = None,
+        errata_enable: Optional[bool] = None,
+        ranges: Optional[Sequence[Tuple[str, Optional[int], Optional[int]]]] = None,
+    ) -> int:
+        """
+        Bitmap of rows passing the ``GET /cards`` filters (same truthiness
+        rules); ``ranges`` are (column, min, max) with inclusive bounds.
+        """
+        mask = self.all_rows
+        if name:
+            mask &= self.like("name", f"%{name}%")
+        if rarity:
+            mask &= self.equals_nocase("rarity", rarity)
+        for column, value in (("level", level), ("round", round)):
+            if value:
+                exact = whole_number(value) if isinstance(self.columns[column], IntColumn) else None
+                mask &= self.equals(column, exact) if exact is not None else self.like(column, f"{value}%")
+        if character_name:
+            mask &= self.like("character_name", f"%{character_name}%")
+        if feature:
+            mask &= self.like("feature", f"%{feature}%")
+        if type:
+            mask &= self.like("type", f"%{type}%")
+        if publication_year:
+            mask &= self.equals("publication_year", publication_year)
+        if number:
+            mask &= self.like("number", f"%{number}%")
+        if errata_enable:
+            mask &= self.equals("errata_enable", 1)
+        for column, low, high in ranges or ():
+            mask &= self.between(column, low, high)
+        return mask
+
+    def facets(self, mask: int, columns: Sequence[str]) -> Dict[str, List[Tuple[Any, int]]]:
+        """
+        (value, count) pairs of each column over the rows in ``mask``, most
+        frequent first; NULL and values with no matching row are left out.
+        One AND + popcount per distinct value, no pass over the rows.
+        """
+        result = {}
+        for column in columns:
+            counts = self.columns[column].counts(mask)
+            counts.pop(None, None)
+            result[column] = sorted(counts.items(), key=lambda item: (-item[1], str(item[0])))
+        return result
+
+    def select(self, **kwargs) -> List[Dict[str, Any]]:
+        """
+        Rows for ``GET /cards``. Without ``sort`` rows come in id order; with
+        it they are ordered by (sort key, id) and ``after`` is the keyset
+        cursor, with a ``_sort`` key added to each row as SQL does.
+        """
+        return list(self.iter_select(**kwargs))
+
+    def iter_select(
+        self,
+        limit: Optional[int] = None,
+        columns: Optional[Sequence[str]] = None,
+        sort: Optional[str] = None,
+        descending: bool = False,
+        after: Optional[Tuple[Any, int]] = None,
+        **filters,
+    ) -> Iterator[Dict[str, Any]]:
+        """``select`` as a generator: rows are built as they are consumed."""
+        mask = self.filter_mask(**filters)
+        if sort is None:
+            yield from self.rows_iter(mask, limit, columns)
+            return
+        keyed = [
+            (self.sort_key(sort, pos, descending), self.columns["id"].get(pos), pos)
+            for pos in iter_positions(mask)
+        ]
+        keyed.sort(reverse=descending)
+        if after is not None:
+            after = tuple(after)
+            keyed = [k for k in keyed if ((k[0], k[1]) < after if descending else (k[0], k[1]) > after)]
+        for key, _, pos in islice(keyed, limit):
+            row = self.row(pos, columns)
+            row["_sort"] = key
+            yield row
+
+    def sort_key(self, sort: str, pos: int, descending: bool = False) -> Any:
+        """The value SQL orders ``sort`` by, with NULL mapped to sort last."""
+        kind = SORT_KEYS[sort]
+        value = self.columns[sort].get(pos)
+        if kind == "int":
+            value = sql_cast_int(value)
+        return SORT_NULL[kind, descending] if value is None else value
+
+    def first_by_number(self, card_id: str) -> Optional[Dict[str, Any]]:
+        found = self.rows(self.like("number", f"%{card_id}%"), limit=1)
+        return found[0] if found else None
+
+    def first_equal(self, column: str, value: Any) -> Optional[Dict[str, Any]]:
+        """Lowest-id row whose ``column`` is exactly ``value``."""
+        found = self.rows(self.equals(column, value), limit=1)
+        return found[0] if found else None
+
+    def search(self, q: str, columns: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+        pattern = f"%{q}%"
+        mask = self.like("name", pattern) | self.like("effect", pattern) | self.like("flavor_text", pattern)
+        return self.rows(mask, columns=columns)
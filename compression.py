@@ -0,0 +1,203 @@
+"""
+Response compression.
+
+``CompressionMiddleware`` compresses text and JSON responses of at least
+``minimum_size`` bytes with the best encoding both sides support: Brotli
+(``br``, needs the optional ``brotli`` package), Zstandard (``zstd``, needs
+``zstandard``) or gzip. Streamed responses are compressed chunk by chunk.
+Responses that already carry a ``Content-Encoding`` are passed through
+untouched, which is how endpoints serve precompressed bodies.
+
+``Precompressed`` holds such bodies: for payloads that only change when the
+data is synced (the full card list, /stats, /llms.txt), each encoding is
+produced once per data version at the highest compression level and then
+served as-is.
+"""
+import threading
+import zlib
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from metrics import stage
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+
+# Server preference, best first; only encodings whose library is installed
+ENCODINGS: List[str] = [e for e, lib in (("br", brotli), ("zstd", zstandard), ("gzip", zlib)) if lib is not None]
+
+# Per-response (fast) and precompressed (once per data version) levels
+DYNAMIC_LEVELS = {"br": 4, "zstd": 3, "gzip": 6}
+STATIC_LEVELS = {"br": 11, "zstd": 19, "gzip": 9}
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/", "application/javascript", "image/svg+xml")
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """Best encoding for an Accept-Encoding header, or None for identity."""
+    if not accept_encoding:
+        return None
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+    best, best_q = None, 0.0
+    for encoding in ENCODINGS:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class _Compressor:
+    """Incremental compressor for one response."""
+
+    def __init__(self, encoding: str, level: int):
+        if encoding == "br":
+            self._obj = brotli.Compressor(quality=level)
+            self.compress, self._finish = self._obj.process, self._obj.finish
+        elif encoding == "zstd":
+            self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+            self.compress, self._finish = self._obj.compress, self._obj.flush
+        else:
+            self._obj = zlib.compressobj(level, zlib.DEFLATED, 31)
+            self.compress, self._finish = self._obj.compress, self._obj.flush
+
+    def finish(self) -> bytes:
+        return self._finish()
+
+
+def compress(data: bytes, encoding: str, level: int) -> bytes:
+    compressor = _Compressor(encoding, level)
+    return compressor.compress(data) + compressor.finish()
+
+
+def encoded_etag(etag: str, encoding: Optional[str]) -> str:
+    """
+    ETag of the ``encoding`` variant of a response. A strong ETag names exact
+    bytes, so each encoding gets its own (``"abc"`` -> ``"abc-gzip"``); weak
+    ones stay shared.
+    """
+    if encoding is None or etag.startswith("W/"):
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+class CompressionMiddleware:
+    """Compress eligible responses with the negotiated Content-Encoding."""
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding"))
+
+        start: Optional[Message] = None
+        compressor: Optional[_Compressor] = None
+
+        async def send_compressed(message: Message):
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or start is None:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                headers = MutableHeaders(scope=start)
+                compressible = (
+                    start["status"] == 200
+                    and "content-encoding" not in headers
+                    and headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+                )
+                if compressible:
+                    # caches must key these on Accept-Encoding, compressed or not
+                    headers.add_vary_header("Accept-Encoding")
+                if not compressible or encoding is None or (not more_body and len(body) < self.minimum_size):
+                    await send(start)
+                    start = None
+                    await send(message)
+                    return
+                compressor = _Compressor(encoding, DYNAMIC_LEVELS[encoding])
+                headers["Content-Encoding"] = encoding
+                if "etag" in headers:
+                    headers["ETag"] = encoded_etag(headers["etag"], encoding)
+                del headers["content-length"]
+                if not more_body:
+                    with stage("compress"):
+                        body = compressor.compress(body) + compressor.finish()
+                    headers["Content-Length"] = str(len(body))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                await send(start)
+            with stage("compress"):
+                chunk = compressor.compress(body)
+                if not more_body:
+                    chunk += compressor.finish()
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+
+class Precompressed:
+    """
+    Compressed variants of payloads that only change with the data version.
+    Each (key, encoding) is built once per version, at ``STATIC_LEVELS``, and
+    only the latest version of a key is kept.
+    """
+
+    def __init__(self):
+        self._entries: Dict[Hashable, Tuple[Hashable, Dict[str, bytes]]] = {}
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.hits = 0
+
+    def get(self, key: Hashable, version: Hashable, encoding: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version or encoding not in entry[1]:
+                return None
+            self.hits += 1
+            return entry[1][encoding]
+
+    def build(self, key: Hashable, version: Hashable, encoding: str, body: bytes) -> bytes:
+        """Compress ``body`` (blocking; run it off the event loop) and keep the result."""
+        with stage("compress"):
+            variant = compress(body, encoding, STATIC_LEVELS[encoding])
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                entry = self._entries[key] = (version, {})
+            entry[1][encoding] = variant
+            self.builds += 1
+        return variant
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            variants = {str(key): {enc: len(body) for enc, body in entry[1].items()} for key, entry in self._entries.items()}
+        return {"encodings": ENCODINGS, "builds": self.builds, "hits": self.hits, "variants": variants}
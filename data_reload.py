@@ -0,0 +1,80 @@
+"""
+Hot reload of the card data in a running worker.
+
+A ``Reloader`` holds the current snapshot of everything loaded from the
+database (data version, in-memory store, ...) together with the *stamp* of
+the file it was loaded from.  ``current()`` compares the stamp on every call
+- a single ``os.stat`` - and when the file has changed (a sync wrote to it
+or swapped in a new file) a background thread loads a new snapshot off to
+the side and swaps the reference.  Copy-on-write: requests that already
+hold the old snapshot finish with it, and until the new one is swapped in
+every caller - including the request that noticed the change, which may be
+running on the event loop - keeps getting the old snapshot instead of
+waiting.  Only the very first load blocks.
+
+Every worker process watches the file on its own, so after the daily sync
+all workers pick up the new data on their next request.
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, Generic, Hashable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class Reloader(Generic[T]):
+    """Current snapshot of the data, reloaded when ``stamp()`` changes."""
+
+    def __init__(self, stamp: Callable[[], Hashable], load: Callable[[Hashable], T]):
+        self.stamp = stamp
+        self.load = load
+        self._snapshot: Optional[T] = None
+        self._stamp: Optional[Hashable] = None
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+        self.reloads = 0
+        self.loaded_at: Optional[float] = None
+
+    def current(self) -> T:
+        """The current snapshot; a changed file is reloaded in the background."""
+        if self._snapshot is None:
+            return self.reload()
+        if self.stamp() != self._stamp:
+            self._reload_in_background()
+        return self._snapshot
+
+    def _reload_in_background(self):
+        with self._thread_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self.reload, name="nebula-reload", daemon=True)
+            self._thread.start()
+
+    def wait(self):
+        """Block until a background reload that is running has finished."""
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def reload(self, force: bool = False, wait: bool = True) -> T:
+        """
+        Load and swap in a new snapshot if the stamp changed (or ``force``).
+        With ``wait=False`` a reload already running in another thread is
+        not waited for; the previous snapshot is returned instead.
+        """
+        if not self._lock.acquire(blocking=wait):
+            return self._snapshot
+        try:
+            stamp = self.stamp()
+            if force or self._snapshot is None or stamp != self._stamp:
+                snapshot = self.load(stamp)
+                self._snapshot, self._stamp = snapshot, stamp
+                self.reloads += 1
+                self.loaded_at = time.time()
+            return self._snapshot
+        finally:
+            self._lock.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"reloads": self.reloads, "loaded_at": self.loaded_at}
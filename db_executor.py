@@ -0,0 +1,88 @@
+"""
+Bounded executor for the blocking work behind the async endpoints.
+
+The data endpoints are ``async def``: cache hits and 304s are answered on
+the event loop, and everything that may touch SQLite (or encode a large
+response) is handed to a dedicated thread pool through ``run``.  Unlike
+Starlette's default thread pool, the executor refuses new work once
+``max_workers`` jobs are running and ``max_queue`` more are waiting,
+raising ``Overloaded`` so the API can answer ``503`` immediately instead of
+queueing without bound during bursts.
+
+Limits come from the environment:
+
+* ``NEBULA_DB_WORKERS`` - threads running database work (default 16)
+* ``NEBULA_DB_QUEUE``   - jobs allowed to wait for a thread (default 64)
+"""
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+
+class Overloaded(Exception):
+    """Raised by ``BoundedExecutor.run`` when every worker and queue slot is taken."""
+
+
+class BoundedExecutor:
+    """Thread pool with a hard limit on running plus queued jobs."""
+
+    def __init__(self, max_workers: int = 16, max_queue: int = 64):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="nebula-db")
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.peak = 0
+
+    @classmethod
+    def from_env(cls) -> "BoundedExecutor":
+        return cls(
+            max_workers=int(os.environ.get("NEBULA_DB_WORKERS", "16")),
+            max_queue=int(os.environ.get("NEBULA_DB_QUEUE", "64")),
+        )
+
+    @property
+    def capacity(self) -> int:
+        return self.max_workers + self.max_queue
+
+    async def run(self, func: Callable[..., Any], *args) -> Any:
+        """
+        Run ``func(*args)`` on a worker thread (in a copy of the caller's
+        context, so per-request state follows it), or raise Overloaded.
+        """
+        with self._lock:
+            if self.pending >= self.capacity:
+                self.rejected += 1
+                raise Overloaded()
+            self.pending += 1
+            self.peak = max(self.peak, self.pending)
+        try:
+            context = contextvars.copy_context()
+            future = self._executor.submit(context.run, func, *args)
+        except BaseException:
+            self._release()
+            raise
+        # the slot is held until the job itself is done (or cancelled before
+        # it started), not until the caller stops waiting for it
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def _release(self, future=None):
+        with self._lock:
+            self.pending -= 1
+            self.completed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "pending": self.pending,
+            "peak": self.peak,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,140 @@
+"""
+Pooled, read-only SQLite connections for the sync endpoints.
+
+Starlette runs plain ``def`` endpoints on a worker thread pool, so the pool
+keeps up to one idle connection per worker thread instead of connecting (and
+re-parsing the schema, and dropping the page cache) on every request.
+Connections are checked out for the duration of a query rather than pinned
+to a thread, because the worker threads themselves come and go.  They are
+opened through a ``mode=ro`` URI, optionally with ``immutable=1`` when the
+database file is known not to change underneath the process.
+
+Tuning knobs come from the environment:
+
+* ``NEBULA_SQLITE_POOL_SIZE``   - idle connections kept (Starlette's 40 threads)
+* ``NEBULA_SQLITE_MMAP_SIZE``   - ``PRAGMA mmap_size`` in bytes
+* ``NEBULA_SQLITE_CACHE_SIZE``  - ``PRAGMA cache_size`` (negative = KiB)
+* ``NEBULA_SQLITE_IMMUTABLE``   - ``1`` to open with ``immutable=1``
+* ``NEBULA_SQLITE_STATEMENTS``  - per-connection prepared statement cache size
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator
+
+from metrics import stage
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+class ConnectionPool:
+    """LIFO pool of read-only connections, opened on demand."""
+
+    def __init__(
+        self,
+        db_path,
+        max_size: int = 40,
+        mmap_size: int = 0,
+        cache_size: int = -2000,
+        immutable: bool = False,
+        cached_statements: int = 128,
+    ):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.immutable = immutable
+        self.cached_statements = cached_statements
+        self._idle = []
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.in_use = 0
+        self.opened = 0
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls, db_path) -> "ConnectionPool":
+        return cls(
+            db_path,
+            max_size=_env_int("NEBULA_SQLITE_POOL_SIZE", 40),
+            mmap_size=_env_int("NEBULA_SQLITE_MMAP_SIZE", 64 * 1024 * 1024),
+            cache_size=_env_int("NEBULA_SQLITE_CACHE_SIZE", -8192),
+            immutable=os.environ.get("NEBULA_SQLITE_IMMUTABLE", "0") == "1",
+            cached_statements=_env_int("NEBULA_SQLITE_STATEMENTS", 128),
+        )
+
+    def uri(self) -> str:
+        uri = Path(self.db_path).resolve().as_uri() + "?mode=ro"
+        if self.immutable:
+            uri += "&immutable=1"
+        return uri
+
+    def _open(self) -> sqlite3.Connection:
+        # A pooled connection is handed from thread to thread, but only ever
+        # used by one of them at a time.
+        conn = sqlite3.connect(
+            self.uri(),
+            uri=True,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        conn.execute(f"PRAGMA cache_size = {int(self.cache_size)}")
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Check out a connection for the duration of the ``with`` block."""
+        with stage("db_checkout"):
+            with self._lock:
+                generation = self._generation
+                conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    self.misses += 1
+                    self.opened += 1
+                else:
+                    self.hits += 1
+                self.in_use += 1
+            if conn is None:
+                conn = self._open()
+        try:
+            yield conn
+        finally:
+            with self._lock:
+                self.in_use -= 1
+                if generation == self._generation and len(self._idle) < self.max_size:
+                    self._idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    def close_all(self):
+        """Close idle connections; checked-out ones are closed on return."""
+        with self._lock:
+            self._generation += 1
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        checkouts = self.hits + self.misses
+        return {
+            "size": len(self._idle) + self.in_use,
+            "idle": len(self._idle),
+            "in_use": self.in_use,
+            "max_size": self.max_size,
+            "opened": self.opened,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / checkouts, 4) if checkouts else 0.0,
+            "mmap_size": self.mmap_size,
+            "cache_size": self.cache_size,
+            "immutable": self.immutable,
+        }
@@ -0,0 +1,99 @@
+"""
+Deck statistics served by ``POST /decks/analyze``.
+
+A deck is a multiset of cards. It is evaluated against the ``CardStore``
+bitmaps rather than row by row: the deck becomes one bitmap per distinct
+quantity (``{1: cards played once, 3: cards played three times, ...}``),
+and the weighted count of any column value is
+
+    sum(quantity * popcount(value_postings & deck_bitmap[quantity]))
+
+so every aggregate (level curve, distributions, battle power totals) is a
+handful of ANDs and popcounts per distinct value, however many decks or
+cards are analyzed.
+"""
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from card_stats import BATTLE_POWER_COLUMNS
+from card_store import CardStore
+
+# Deck aggregates: response key -> column counted
+DISTRIBUTIONS = {
+    "level_curve": "level",
+    "round_curve": "round",
+    "feature_distribution": "feature",
+    "type_distribution": "type",
+    "rarity_distribution": "rarity",
+    "character_distribution": "character_name",
+}
+
+
+def lowest_position(bitmap: int) -> Optional[int]:
+    return (bitmap & -bitmap).bit_length() - 1 if bitmap else None
+
+
+def resolve_number(store: CardStore, number: str) -> Optional[int]:
+    """Row of ``number``: exact match first, then the /card/{number} substring match."""
+    if not number.strip():
+        return None
+    return lowest_position(store.equals("number", number) or store.like("number", f"%{number}%"))
+
+
+def deck_bitmaps(store: CardStore, entries: Iterable[Tuple[str, int]]) -> Tuple[Dict[int, int], List[str]]:
+    """
+    ({quantity: bitmap of rows}, unresolved numbers) for (number, quantity)
+    pairs; quantities of numbers resolving to the same card add up.
+    """
+    quantities: Dict[int, int] = {}
+    missing: List[str] = []
+    for number, quantity in entries:
+        pos = resolve_number(store, number)
+        if pos is None:
+            if number not in missing:
+                missing.append(number)
+            continue
+        quantities[pos] = quantities.get(pos, 0) + quantity
+    by_quantity: Dict[int, int] = {}
+    for pos, quantity in quantities.items():
+        by_quantity[quantity] = by_quantity.get(quantity, 0) | (1 << pos)
+    return by_quantity, missing
+
+
+def weighted_counts(store: CardStore, column: str, by_quantity: Dict[int, int]) -> Dict[Any, int]:
+    """Copies in the deck per non-NULL value of ``column``."""
+    deck = 0
+    for bitmap in by_quantity.values():
+        deck |= bitmap
+    counts = {}
+    for value in store.columns[column].counts(deck):
+        if value is None:
+            continue
+        postings = store.columns[column].equals(value)
+        counts[value] = sum(q * (postings & bitmap).bit_count() for q, bitmap in by_quantity.items())
+    return counts
+
+
+def analyze_deck(store: CardStore, entries: Iterable[Tuple[str, int]]) -> Dict[str, Any]:
+    """Aggregates of one deck given as (card number, quantity) pairs."""
+    by_quantity, missing = deck_bitmaps(store, entries)
+    result: Dict[str, Any] = {
+        "total_cards": sum(q * bitmap.bit_count() for q, bitmap in by_quantity.items()),
+        "unique_cards": sum(bitmap.bit_count() for bitmap in by_quantity.values()),
+    }
+    for key, column in DISTRIBUTIONS.items():
+        counts = weighted_counts(store, column, by_quantity)
+        ordered = sorted(counts.items(), key=lambda item: (-item[1], str(item[0])))
+        result[key] = {str(value): n for value, n in ordered}
+    battle_power = {}
+    for column in BATTLE_POWER_COLUMNS:
+        counts = weighted_counts(store, column, by_quantity)
+        cards = sum(counts.values())
+        total = sum(value * n for value, n in counts.items())
+        battle_power[column] = {
+            "total": total,
+            "cards": cards,
+            "average": round(total / cards, 1) if cards else None,
+        }
+    result["battle_power"] = battle_power
+    result["missing"] = missing
+    return result
@@ -0,0 +1,148 @@
+"""
+Export the card data endpoints as static files for CDN/edge serving.
+
+The data only changes when update_card_db.py syncs it, so every response
+below is fixed until the next sync. This script requests them from the API
+in-process (so the bytes are exactly what the API would serve) and writes
+each one as JSON plus a precompressed copy per available encoding
+(``.gz``, and ``.br`` / ``.zst`` when brotli / zstandard are installed):
+
+* ``/cards``                        -> ``cards.json``
+* ``/card/{number}``                -> ``card/{number}.json``
+* ``/cards?rarity={value}``         -> ``cards/rarity/{value}.json``
+* ``/cards?character_name={value}`` -> ``cards/character_name/{value}.json``
+* ``/stats``                        -> ``stats.json``
+
+Path segments are percent-encoded. ``manifest.json`` maps every URL to its
+files, sizes, SHA-256 and the API's ETag. The export is written to a
+temporary directory that replaces ``--out`` when complete, and is skipped
+when ``--out`` already holds the current data version and build (unless
+``--force``). Run it after a sync:
+
+    python update_card_db.py && python export_static.py [--out static] [--force]
+
+Anything not exported (other filters, sorting, paging, search) is still
+answered by the API.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+from pathlib import Path
+from urllib.parse import quote, urlencode
+
+from compression import ENCODINGS, STATIC_LEVELS, compress
+
+OUT_DIR = "static"
+
+# File suffix of each precompressed copy
+SUFFIXES = {"gzip": ".gz", "br": ".br", "zstd": ".zst"}
+
+# /cards filters exported once per distinct value
+FILTERS = ("rarity", "character_name")
+
+
+def api_paths(db_file):
+    """(url, relative file) for every exported response."""
+    conn = sqlite3.connect(db_file)
+    try:
+        numbers = [r[0] for r in conn.execute("SELECT DISTINCT number FROM cards WHERE number IS NOT NULL ORDER BY number")]
+        values = {
+            column: [r[0] for r in conn.execute(
+                f"SELECT DISTINCT {column} FROM cards WHERE {column} IS NOT NULL AND {column} != '' ORDER BY {column}")]
+            for column in FILTERS
+        }
+    finally:
+        conn.close()
+
+    paths = [("/cards", "cards.json"), ("/stats", "stats.json")]
+    # numbers containing "/" (e.g. "AP(01/20) BP01-001") cannot be path segments
+    paths += [(f"/card/{quote(n, safe='')}", f"card/{quote(n, safe='')}.json") for n in numbers if "/" not in n]
+    for column, column_values in values.items():
+        seen = set()
+        for value in column_values:
+            # the filters match case-insensitively: one file per value
+            if value.lower() in seen:
+                continue
+            seen.add(value.lower())
+            paths.append((f"/cards?{urlencode({column: value})}", f"cards/{column}/{quote(value, safe='')}.json"))
+    return paths
+
+
+def write_file(path: Path, body: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(body)
+
+
+def current_versions():
+    import nebula_api  # pylint: disable=import-outside-toplevel
+    return nebula_api.data_version(), nebula_api.BUILD_ID
+
+
+def export(out_dir=OUT_DIR, force=False):
+    """Write the static export into ``out_dir``; returns the manifest (None when already current)."""
+    from fastapi.testclient import TestClient  # pylint: disable=import-outside-toplevel
+    import nebula_api  # pylint: disable=import-outside-toplevel
+
+    out = Path(out_dir)
+    data_version, build_id = current_versions()
+    manifest_file = out / "manifest.json"
+    if not force and manifest_file.exists():
+        previous = json.loads(manifest_file.read_text(encoding="utf-8"))
+        if (previous.get("data_version"), previous.get("build")) == (data_version, build_id):
+            print(f"Static export in '{out}' is already at data version {data_version}.")
+            return None
+
+    tmp = out.with_name(f"{out.name}.tmp-{os.getpid()}")
+    shutil.rmtree(tmp, ignore_errors=True)
+    client = TestClient(nebula_api.app, headers={"Accept-Encoding": "identity"})
+    files = {}
+    start = time.perf_counter()
+    for url, rel in api_paths(nebula_api.DB_PATH):
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} returned {response.status_code}")
+        body = response.content
+        write_file(tmp / rel, body)
+        entry = {
+            "file": rel,
+            "content_type": response.headers["content-type"],
+            "etag": response.headers.get("etag"),
+            "bytes": len(body),
+            "sha256": hashlib.sha256(body).hexdigest(),
+            "encodings": {},
+        }
+        for encoding in ENCODINGS:
+            variant = compress(body, encoding, STATIC_LEVELS[encoding])
+            write_file(tmp / (rel + SUFFIXES[encoding]), variant)
+            entry["encodings"][encoding] = {"file": rel + SUFFIXES[encoding], "bytes": len(variant)}
+        files[url] = entry
+
+    manifest = {
+        "data_version": data_version,
+        "build": build_id,
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "encodings": ENCODINGS,
+        "files": files,
+    }
+    (tmp / "manifest.json").write_text(json.dumps(manifest, indent=1, ensure_ascii=False) + "\n", encoding="utf-8")
+
+    # swap the finished export in; readers never see a half-written tree
+    old = out.with_name(f"{out.name}.old-{os.getpid()}")
+    if out.exists():
+        out.rename(old)
+    tmp.rename(out)
+    shutil.rmtree(old, ignore_errors=True)
+    print(f"Exported {len(files)} responses to '{out}' in {time.perf_counter() - start:.1f}s; data version {data_version}.")
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--out", default=OUT_DIR, help="directory to write the export to")
+    parser.add_argument("--force", action="store_true", help="export even if the data version is unchanged")
+    args = parser.parse_args()
+    export(args.out, args.force)
@@ -0,0 +1,199 @@
+"""
+HTTP validators for the read-only endpoints.
+
+Every response is a pure function of (deployed code, database contents,
+request URL), so a single version string is enough to validate any cached
+copy: the middleware tags ``GET``/``HEAD`` responses on the covered paths
+with ``ETag: W/"<version>"`` plus ``Cache-Control`` (and ``X-Data-Version``
+when configured), and answers a matching
+``If-None-Match`` with ``304`` before the request reaches an endpoint (and
+therefore without touching the database).
+
+``ResponseCache`` covers the requests that do reach an endpoint: hot filter
+and search combinations are served from already-encoded JSON bytes.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Sequence, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match comparison (weak, as RFC 9110 requires for GET)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+class HTTPCacheMiddleware:
+    """ETag / Cache-Control / 304 handling keyed on a version string."""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        version: Callable[[], str],
+        paths: Sequence[str],
+        max_age: int = 300,
+        data_version: Optional[Callable[[], str]] = None,
+    ):
+        self.app = app
+        self.version = version
+        self.data_version = data_version
+        self.paths = tuple(paths)
+        self.cache_control = f"public, max-age={max_age}, stale-while-revalidate={max_age}"
+
+    def covers(self, path: str) -> bool:
+        return path.startswith(self.paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in ("GET", "HEAD")
+            or not self.covers(scope["path"])
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        etag = f'W/"{self.version()}"'
+        data_version = self.data_version() if self.data_version else None
+        if etag_matches(Headers(scope=scope).get("if-none-match"), etag):
+            headers = [
+                (b"etag", etag.encode("latin-1")),
+                (b"cache-control", self.cache_control.encode("latin-1")),
+            ]
+            if data_version:
+                headers.append((b"x-data-version", data_version.encode("latin-1")))
+            await send({"type": "http.response.start", "status": 304, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_with_validators(message: Message):
+            if message["type"] == "http.response.start" and message["status"] in (200, 304):
+                headers = MutableHeaders(scope=message)
+                # endpoints with their own strong validator (e.g. /stats) keep it
+                if "etag" not in headers:
+                    headers["ETag"] = etag
+                if "cache-control" not in headers:
+                    headers["Cache-Control"] = self.cache_control
+                if data_version:
+                    headers["X-Data-Version"] = data_version
+            await send(message)
+
+        await self.app(scope, receive, send_with_validators)
+
+
+class ResponseCache:
+    """
+    Bounded LRU cache of encoded response bodies.
+
+    Entries are keyed on normalized query parameters and tagged with the data
+    version they were rendered from; the first lookup under a new version
+    drops everything. Size is accounted in body bytes, and entries older than
+    ``ttl`` seconds (if set) are treated as misses.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, ttl: float = 0, clock: Callable[[], float] = time.monotonic):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: "OrderedDict[Hashable, Tuple[bytes, Dict[str, str], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.version: Optional[str] = None
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @classmethod
+    def from_env(cls) -> "ResponseCache":
+        return cls(
+            max_bytes=int(os.environ.get("NEBULA_RESPONSE_CACHE_BYTES", str(32 * 1024 * 1024))),
+            ttl=float(os.environ.get("NEBULA_RESPONSE_CACHE_TTL", "0")),
+        )
+
+    def _check_version(self, version: str):
+        if version != self.version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.bytes = 0
+            self.version = version
+
+    def get(self, key: Hashable, version: str) -> Optional[Tuple[bytes, Dict[str, str]]]:
+        """Cached (body, headers) for ``key``, or None."""
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl and self.clock() - entry[2] > self.ttl:
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def put(self, key: Hashable, version: str, body: bytes, headers: Optional[Dict[str, str]] = None):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            self._check_version(version)
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (body, headers or {}, self.clock())
+            self.bytes += len(body)
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: Hashable):
+        body = self._entries.pop(key)[0]
+        self.bytes -= len(body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+            self.version = None
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+def normalize_params(**params) -> Tuple[Tuple[str, Any], ...]:
+    """
+    Cache key for a set of query parameters. Parameters the endpoints treat as
+    "not given" (None, "", False, 0) are dropped, and strings are ASCII
+    lower-cased because every text filter matches case-insensitively.
+    """
+    return tuple(sorted(
+        (name, value.translate(_ASCII_LOWER) if isinstance(value, str) else value)
+        for name, value in params.items()
+        if value not in (None, "", False, 0)
+    ))
+
+
+_ASCII_LOWER = {code: code + 32 for code in range(ord("A"), ord("Z") + 1)}
@@ -0,0 +1,276 @@
+"""
+Per-request timing instrumentation, Prometheus metrics and a slow-request
+sampling profiler.
+
+``MetricsMiddleware`` opens a ``RequestMetrics`` for every HTTP request and
+keeps it in a context variable, so instrumented code anywhere below the
+endpoint (including work handed to ``db_executor``, which copies the
+context) can report into it:
+
+* ``stage(name)`` - context manager adding wall time to a named stage
+  (``db_checkout``, ``sql``, ``rows``, ``validate``, ``encode``, ...)
+* ``count(name, n)`` - per-request counters (``rows``, ``sql_vm_steps``)
+
+When the request finishes the stage timings are sent back in a
+``Server-Timing`` header and folded into histograms labelled by route
+template (``/card/{card_id}``, not the raw path), which ``/metrics`` renders
+in the Prometheus text format.
+
+With ``NEBULA_PROFILE_SLOW_MS`` set, a background thread samples the stacks
+of the threads working on in-flight requests every
+``NEBULA_PROFILE_INTERVAL_MS`` and requests slower than the threshold dump
+their samples as collapsed stacks (flame graph input) into
+``NEBULA_PROFILE_DIR``.
+"""
+import contextvars
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+_current: contextvars.ContextVar[Optional["RequestMetrics"]] = contextvars.ContextVar("request_metrics", default=None)
+
+
+class RequestMetrics:
+    """Stage timings and counters of one request."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self.threads = {threading.get_ident()}
+        self.samples: Counter = Counter()
+
+    def add_stage(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+
+def current() -> Optional[RequestMetrics]:
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time the ``with`` block as stage ``name`` of the current request."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    # the profiler samples every thread that worked on the request
+    metrics.threads.add(threading.get_ident())
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_stage(name, time.perf_counter() - start)
+
+
+def count(name: str, n: int = 1):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.counters[name] = metrics.counters.get(name, 0) + n
+
+
+# ======================================================
+# Prometheus histograms
+# ======================================================
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+COUNT_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 5000, 10000, 100000, 1000000)
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, rendered in Prometheus text format."""
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted(self._series.items())
+        for labels, (counts, total, n) in series:
+            label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.label_names, labels))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{label_text},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total!r}")
+            lines.append(f"{self.name}_count{{{label_text}}} {n}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Registry:
+    """The histograms recorded for every request."""
+
+    def __init__(self):
+        self.requests = Histogram(
+            "nebula_request_duration_seconds", "Request duration", ("route", "method", "status"), SECONDS_BUCKETS)
+        self.stages = Histogram(
+            "nebula_request_stage_seconds", "Time spent per request stage", ("route", "stage"), SECONDS_BUCKETS)
+        self.response_bytes = Histogram(
+            "nebula_response_bytes", "Response body size", ("route",), BYTES_BUCKETS)
+        self.counters = Histogram(
+            "nebula_request_counts", "Per-request counts (rows returned, SQLite VM steps)", ("route", "counter"), COUNT_BUCKETS)
+
+    def record(self, route: str, method: str, status: int, metrics: RequestMetrics, body_bytes: int, seconds: float):
+        self.requests.observe((route, method, str(status)), seconds)
+        for name, value in metrics.stages.items():
+            self.stages.observe((route, name), value)
+        for name, value in metrics.counters.items():
+            self.counters.observe((route, name), value)
+        self.response_bytes.observe((route,), body_bytes)
+
+    def render(self) -> str:
+        lines = []
+        for histogram in (self.requests, self.stages, self.response_bytes, self.counters):
+            lines += histogram.render()
+        return "\n".join(lines) + "\n"
+
+
+# ======================================================
+# Slow-request profiler
+# ======================================================
+class SlowRequestProfiler:
+    """Samples the stacks of threads serving in-flight requests."""
+
+    def __init__(self, threshold_ms: float, interval_ms: float = 5, directory="profiles"):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.directory = Path(directory)
+        self._active: Dict[int, RequestMetrics] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._busy = threading.Event()
+        self.dumps = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["SlowRequestProfiler"]:
+        threshold = os.environ.get("NEBULA_PROFILE_SLOW_MS")
+        if not threshold:
+            return None
+        return cls(
+            float(threshold),
+            float(os.environ.get("NEBULA_PROFILE_INTERVAL_MS", "5")),
+            os.environ.get("NEBULA_PROFILE_DIR", "profiles"),
+        )
+
+    def begin(self, metrics: RequestMetrics):
+        with self._lock:
+            self._active[id(metrics)] = metrics
+            self._busy.set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample_forever, name="nebula-profiler", daemon=True)
+                self._thread.start()
+
+    def end(self, metrics: RequestMetrics, route: str, seconds: float) -> Optional[Path]:
+        with self._lock:
+            self._active.pop(id(metrics), None)
+            if not self._active:
+                self._busy.clear()
+        if seconds < self.threshold or not metrics.samples:
+            return None
+        self.directory.mkdir(parents=True, exist_ok=True)
+        name = route.strip("/").replace("/", "_").replace("{", "").replace("}", "") or "root"
+        path = self.directory / f"{time.strftime('%Y%m%dT%H%M%S')}-{name}-{int(seconds * 1000)}ms-{id(metrics):x}.folded"
+        path.write_text("".join(f"{stack} {n}\n" for stack, n in metrics.samples.most_common()), encoding="utf-8")
+        self.dumps += 1
+        return path
+
+    def _sample_forever(self):
+        me = threading.get_ident()
+        while True:
+            self._busy.wait()  # idle until a request is in flight
+            time.sleep(self.interval)
+            with self._lock:
+                active = list(self._active.values())
+            frames = sys._current_frames()  # pylint: disable=protected-access
+            stacks = {tid: _collapse(frame) for tid, frame in frames.items() if tid != me}
+            for metrics in active:
+                for tid in tuple(metrics.threads):
+                    if tid in stacks:
+                        metrics.samples[stacks[tid]] += 1
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{Path(code.co_filename).name}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+# ======================================================
+# Middleware
+# ======================================================
+class MetricsMiddleware:
+    """Times every HTTP request, adds Server-Timing and records histograms."""
+
+    def __init__(self, app: ASGIApp, registry: Registry, profiler: Optional[SlowRequestProfiler] = None):
+        self.app = app
+        self.registry = registry
+        self.profiler = profiler
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        if self.profiler:
+            self.profiler.begin(metrics)
+        status = 500
+        body_bytes = 0
+
+        async def send_with_timing(message: Message):
+            nonlocal status, body_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                timings = [f"{name};dur={seconds * 1000:.3f}" for name, seconds in metrics.stages.items()]
+                timings.append(f"total;dur={metrics.elapsed() * 1000:.3f}")
+                MutableHeaders(scope=message).append("Server-Timing", ", ".join(timings))
+            elif message["type"] == "http.response.body":
+                body_bytes += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            seconds = metrics.elapsed()
+            route = getattr(scope.get("route"), "path", "unmatched")
+            self.registry.record(route, scope["method"], status, metrics, body_bytes, seconds)
+            if self.profiler:
+                self.profiler.end(metrics, route, seconds)
@@ -1,15 +1,49 @@
-from fastapi import FastAPI, Query
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
 from fastapi.responses import RedirectResponse
+from fastapi.responses import JSONResponse
+from fastapi.responses import Response
+from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager
+import asyncio
+import base64
+import csv
+import hashlib
+import io
+import json
+import os
+import secrets
 import sqlite3
+import threading
+import zlib
+from functools import lru_cache, wraps
+from itertools import islice
 from pathlib import Path
-from typing import List, Optional
-from pydantic import BaseModel, field_validator
+from typing import Annotated, Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import quote
+from pydantic import BaseModel, Field, TypeAdapter, create_model, field_validator
+from card_stats import compute_stats, encode_stats, read_stats_table
+from card_snapshot import open_snapshot, snapshot_path
+from card_store import SORT_KEYS, SORT_NULL, CardStore, whole_number
+from compression import CompressionMiddleware, Precompressed, encoded_etag, negotiate
+from db_executor import BoundedExecutor, Overloaded
+from deck_stats import analyze_deck
+from data_reload import Reloader
+from db_pool import ConnectionPool
+from http_cache import HTTPCacheMiddleware, ResponseCache, etag_matches, normalize_params
+from suggest import MAX_LIMIT as SUGGEST_MAX, SuggestIndex
+from metrics import MetricsMiddleware, Registry, SlowRequestProfiler, count, current, stage
 
 # ======================================================
 # Pydantic model for returning card data
 # ======================================================
+def strip_decimal(v):
+    """level/round: integers, or "3.0"-style text in databases synced before they were normalized"""
+    if isinstance(v, int):
+        return str(v)
+    return v[:-2] if isinstance(v, str) and v.endswith(".0") else v
+
+
 class Card(BaseModel):
     id: int
     name: str
@@ -20,13 +54,13 @@ class Card(BaseModel):
     type: Optional[str]
     feature: Optional[str]
     level: Optional[str]
-    @field_validator("level")
+    @field_validator("level", mode="before")
     def strip_decimal_level(cls, v): #pylint: disable=E0213
-        return v[:-2] if isinstance(v, str) and v.endswith(".0") else v
+        return strip_decimal(v)
     round: Optional[str]
-    @field_validator("round")
+    @field_validator("round", mode="before")
     def strip_decimal_round(cls, v): #pylint: disable=E0213
-        return v[:-2] if isinstance(v, str) and v.endswith(".0") else v
+        return strip_decimal(v)
     battle_power_1: Optional[int]
     battle_power_2: Optional[int]
     battle_power_3: Optional[int]
@@ -50,10 +84,89 @@ class Card(BaseModel):
     display_card_bundle_names: str
 
 
+class SearchResult(Card):
+    snippet: Optional[str] = None
+
+
+class Suggestion(BaseModel):
+    value: str
+    field: str
+    cards: int
+    number: Optional[str]
+
+
+# Deck lists are 50 cards; leave room for side decks and collections
+BATCH_MAX = 500
+
+# SQLite's integer range: larger Python ints cannot be bound as parameters
+INT64_MIN, INT64_MAX = -(2 ** 63), 2 ** 63 - 1
+
+class CardBatchRequest(BaseModel):
+    numbers: List[str] = Field(default_factory=list, max_length=BATCH_MAX)
+    ids: List[Annotated[int, Field(ge=INT64_MIN, le=INT64_MAX)]] = Field(default_factory=list, max_length=BATCH_MAX)
+
+
+class CardBatch(BaseModel):
+    cards: List[Card]
+    missing: List[str]
+
+
+# Decks per POST /decks/analyze/bulk request (tournament reports)
+DECKS_MAX = 256
+
+class DeckEntry(BaseModel):
+    number: str
+    quantity: int = Field(1, ge=1, le=BATCH_MAX)
+
+class DeckRequest(BaseModel):
+    name: Optional[str] = None
+    cards: List[DeckEntry] = Field(max_length=BATCH_MAX)
+
+class BulkDeckRequest(BaseModel):
+    decks: List[DeckRequest] = Field(max_length=DECKS_MAX)
+
+class BattlePowerSummary(BaseModel):
+    total: int
+    cards: int
+    average: Optional[float]
+
+class DeckAnalysis(BaseModel):
+    name: Optional[str] = None
+    total_cards: int
+    unique_cards: int
+    level_curve: Dict[str, int]
+    round_curve: Dict[str, int]
+    feature_distribution: Dict[str, int]
+    type_distribution: Dict[str, int]
+    rarity_distribution: Dict[str, int]
+    character_distribution: Dict[str, int]
+    battle_power: Dict[str, BattlePowerSummary]
+    missing: List[str]
+
+class BulkDeckAnalysis(BaseModel):
+    decks: List[DeckAnalysis]
+
+
 # ======================================================
 # FastAPI app setup
 # ======================================================
-app = FastAPI(title="Nebula-API")
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    data_snapshot()
+    yield
+
+
+app = FastAPI(title="Nebula-API", lifespan=lifespan)
+
+# ETag / Cache-Control / 304 for everything derived from the card data.
+# Added before CORS so that 304 responses still get CORS headers.
+app.add_middleware(
+    HTTPCacheMiddleware,
+    version=lambda: f"{BUILD_ID}-{data_version()}",
+    data_version=lambda: data_version(),
+    paths=["/cards", "/card/", "/search", "/suggest", "/stats", "/llms.txt"],
+    max_age=int(os.environ.get("NEBULA_CACHE_MAX_AGE", "300")),
+)
 
 # Enable CORS (so your frontend can connect)
 app.add_middleware(
@@ -64,6 +177,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# gzip (and br/zstd when installed) for text and JSON responses of at least
+# NEBULA_COMPRESS_MIN_BYTES. Outside the cache middleware, so 304s skip it.
+COMPRESSION = os.environ.get("NEBULA_COMPRESSION", "1") == "1"
+COMPRESS_MIN_BYTES = int(os.environ.get("NEBULA_COMPRESS_MIN_BYTES", "1024"))
+if COMPRESSION:
+    app.add_middleware(CompressionMiddleware, minimum_size=COMPRESS_MIN_BYTES)
+
+# Per-stage timings (Server-Timing header, /metrics histograms) and the
+# opt-in slow-request profiler. Outermost, so the totals include the other
+# middleware.
+metrics_registry = Registry()
+if os.environ.get("NEBULA_METRICS", "1") == "1":
+    app.add_middleware(MetricsMiddleware, registry=metrics_registry, profiler=SlowRequestProfiler.from_env())
+
+# Shed load instead of queueing without bound when db_executor is saturated
+@app.exception_handler(Overloaded)
+async def overloaded_handler(_request: Request, _exc: Overloaded):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server busy, please retry shortly"},
+        headers={"Retry-After": "1"},
+    )
+
 
 # ======================================================
 # Database helper
@@ -72,14 +208,739 @@ BASE_DIR = Path(__file__).resolve().parent
 DB_PATH = "ultraman_cards.db"
 LLMS_TXT_PATH = BASE_DIR / "public" / "llms.txt"
 
+# Changes whenever the deployed code or llms.txt changes, so cached responses
+# are revalidated after a deploy even if the card data did not change.
+BUILD_ID = hashlib.sha256(
+    b"".join(path.read_bytes() for path in sorted(BASE_DIR.glob("*.py")) + [LLMS_TXT_PATH])
+).hexdigest()[:8]
+
+# "sqlite" queries the database on every request, "memory" answers from an
+# in-process CardStore loaded once at startup.
+ENGINE = os.environ.get("NEBULA_ENGINE", "sqlite").lower()
+
+db_pool = ConnectionPool.from_env(DB_PATH)
+
+# The data endpoints are async; anything that may block on SQLite runs here
+db_executor = BoundedExecutor.from_env()
+
+# SQLite VM instructions between progress callbacks, for the sql_vm_steps
+# count (a proxy for rows scanned)
+VM_STEP_GRANULARITY = 100
+
 def query_db(query: str, params: tuple = ()):
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute(query, params)
-    rows = cursor.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+    with db_pool.connection() as conn:
+        metrics = current()
+        if metrics is not None:
+            conn.set_progress_handler(lambda: count("sql_vm_steps", VM_STEP_GRANULARITY), VM_STEP_GRANULARITY)
+        try:
+            with stage("sql"):
+                rows = conn.execute(query, params).fetchall()
+        finally:
+            if metrics is not None:
+                conn.set_progress_handler(None, 0)
+    with stage("rows"):
+        result = [dict(row) for row in rows]
+    count("rows", len(result))
+    return result
+
+
+def db_stamp() -> tuple:
+    """Cheap change detector for the database file: (path, mtime_ns, size)"""
+    st = os.stat(DB_PATH)
+    return (DB_PATH, st.st_mtime_ns, st.st_size)
+
+class DataSnapshot:
+    """One loaded version of the database: its data version and, lazily, its CardStore"""
+
+    def __init__(self, stamp: tuple, version: str):
+        self.stamp = stamp
+        self.version = version
+        self._store: Optional[CardStore] = None
+        self.store_source: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def card_store(self) -> CardStore:
+        # mapped from the binary snapshot written by the same sync when there
+        # is one (shared by every worker), otherwise loaded from the table
+        if self._store is None:
+            with self._lock:
+                if self._store is None:
+                    store = open_snapshot(snapshot_path(DB_PATH), self.version)
+                    self.store_source = "snapshot" if store is not None else "sqlite"
+                    self._store = store or CardStore.from_sqlite(DB_PATH)
+        return self._store
+
+def read_data_version(stamp: tuple) -> str:
+    """
+    Content version written by update_card_db.py, or the file's mtime/size
+    for databases built before the meta table existed.
+    """
+    with db_pool.connection() as conn:
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'data_version'").fetchone()
+        except sqlite3.OperationalError:
+            row = None
+    if row is not None:
+        return row["value"]
+    _, mtime_ns, size = stamp
+    return f"{mtime_ns:x}-{size:x}"
+
+def load_snapshot(stamp: tuple) -> DataSnapshot:
+    # idle connections opened before a sync swapped the file would keep
+    # reading the old one
+    db_pool.close_all()
+    snapshot = DataSnapshot(stamp, read_data_version(stamp))
+    if ENGINE == "memory":
+        snapshot.card_store()
+    return snapshot
+
+# Reloads (copy-on-write, without blocking readers) whenever a sync changes the file
+data_reloader = Reloader(db_stamp, load_snapshot)
+
+def data_snapshot() -> DataSnapshot:
+    return data_reloader.current()
+
+def data_version() -> str:
+    return data_snapshot().version
+
+def get_card_store() -> CardStore:
+    return data_snapshot().card_store()
+
+def cached_per_snapshot(func):
+    """Memoize a zero-argument loader until the next data reload"""
+    cache = {"entry": (None, None)}
+
+    @wraps(func)
+    def wrapper():
+        snapshot = data_snapshot()
+        cached_for, value = cache["entry"]
+        if cached_for is not snapshot:
+            value = func()
+            cache["entry"] = (snapshot, value)
+        return value
+
+    return wrapper
+
+@cached_per_snapshot
+def stats_snapshot() -> Tuple[bytes, str]:
+    """
+    Encoded /stats payload and its ETag, read from the stats table written by
+    update_card_db.py (or computed once for older databases).
+    """
+    with db_pool.connection() as conn:
+        return read_stats_table(conn) or encode_stats(compute_stats(conn))
+
+@cached_per_snapshot
+def fts_tokenizer() -> Optional[str]:
+    """Tokenizer of the cards_fts index built by update_card_db.py, or None if absent"""
+    with db_pool.connection() as conn:
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'cards_fts'").fetchone()
+    if row is None:
+        return None
+    return "trigram" if "trigram" in row["sql"] else "unicode61"
+
+def fts_query(q: str, tokenizer: Optional[str]) -> Optional[str]:
+    """
+    Turn user input into an FTS5 MATCH expression, or None when the index
+    cannot answer it (no index, or fewer than 3 characters for trigram).
+    """
+    if tokenizer is None or not q.strip():
+        return None
+    phrase = '"' + q.replace('"', '""') + '"'
+    if tokenizer == "trigram":
+        return phrase if len(q) >= 3 else None
+    return phrase + " *"
+
+@cached_per_snapshot
+def suggest_index() -> SuggestIndex:
+    """Autocomplete index over the current data, rebuilt after each reload"""
+    return SuggestIndex.from_store(get_card_store())
+
+@cached_per_snapshot
+def integer_columns() -> frozenset:
+    """Columns declared INTEGER (level/round were text before sync normalized them)"""
+    with db_pool.connection() as conn:
+        rows = conn.execute("PRAGMA table_info(cards)").fetchall()
+    return frozenset(row["name"] for row in rows if row["type"].upper() == "INTEGER")
+
+@lru_cache(maxsize=1)
+def llms_txt_bytes() -> bytes:
+    return LLMS_TXT_PATH.read_bytes()
+
+
+# WHERE clause for each get_cards filter, in the order they are applied.
+# Substring filters match the distinct values in the column's covering index
+# and then look the rows up by value, instead of scanning the whole table;
+# update_card_db.py creates the indexes.
+def substring_sql(column: str) -> str:
+    return f"{column} IN (SELECT {column} FROM cards WHERE {column} LIKE ?)"
+
+CARD_FILTER_SQL = {
+    "name": substring_sql("name"),
+    "rarity": "rarity = ? COLLATE NOCASE",
+    "level": "level = ?",
+    "level_prefix": "level LIKE ?",
+    "round": "round = ?",
+    "round_prefix": "round LIKE ?",
+    "character_name": substring_sql("character_name"),
+    "feature": substring_sql("feature"),
+    "type": substring_sql("type"),
+    "publication_year": "publication_year = ?",
+    "number": substring_sql("number"),
+    "errata_enable": "errata_enable = 1",
+}
+
+# Range filter parameter prefix -> column; bounds are inclusive integers
+RANGE_PARAMS = {
+    "bp1": "battle_power_1",
+    "bp2": "battle_power_2",
+    "bp3": "battle_power_3",
+    "bp4": "battle_power_4",
+    "bp_ex": "battle_power_ex",
+    "level": "level",
+    "round": "round",
+    "year": "publication_year",
+}
+
+# INTEGER columns compare directly and use their index; text columns (level
+# and round in databases synced before they were integers) compare as
+# CAST(column AS INTEGER), as CardStore.between does. Both bounds are always
+# bound (an open one as the int64 extreme): with one, the planner prefers
+# scanning the table in id order over the index.
+for _column in RANGE_PARAMS.values():
+    CARD_FILTER_SQL.update({
+        f"{_column}_range": f"{_column} BETWEEN ? AND ?",
+        f"{_column}_range_text": f"CAST({_column} AS INTEGER) BETWEEN ? AND ?",
+    })
+
+def clamp_int64(value: int) -> int:
+    """``value`` moved into SQLite's integer range (larger ints cannot be bound)"""
+    return min(max(value, INT64_MIN), INT64_MAX)
+
+def sort_sql(sort: str, descending: bool) -> str:
+    """SQL expression matching CardStore.sort_key: typed, with NULLs last"""
+    kind = SORT_KEYS[sort]
+    null = SORT_NULL[kind, descending]
+    if kind == "int":
+        return f"COALESCE(CAST({sort} AS INTEGER), {null})"
+    return f"COALESCE({sort}, char(1114111))" if null else f"COALESCE({sort}, '')"
+
+@lru_cache(maxsize=512)
+def cards_sql(
+    filters: tuple,
+    limited: bool,
+    columns: Optional[tuple] = None,
+    sort: Optional[str] = None,
+    descending: bool = False,
+    keyset: bool = False,
+) -> str:
+    """
+    Build the get_cards SQL for a combination of filters. Cached so the same
+    combination always yields the same string and hits the statement cache.
+    With ``sort`` the rows are ordered by (sort key, id), the key is returned
+    as ``_sort``, and ``keyset`` adds the ``(key, id)`` cursor predicate.
+    """
+    select = ", ".join(columns) if columns else "*"
+    if sort:
+        key = sort_sql(sort, descending)
+        select += f", {key} AS _sort"
+    query = f"SELECT {select} FROM cards WHERE 1=1"
+    for column in filters:
+        query += " AND " + CARD_FILTER_SQL[column]
+    if sort:
+        direction = "DESC" if descending else "ASC"
+        if keyset:
+            query += f" AND ({key}, id) {'<' if descending else '>'} (?, ?)"
+        query += f" ORDER BY _sort {direction}, id {direction}"
+    else:
+        query += " ORDER BY id"
+    if limited:
+        query += " LIMIT ?"
+    return query
+
+
+# ======================================================
+# Queries
+# ======================================================
+def select_cards(
+    name=None, rarity=None, level=None, round=None, # pylint: disable=redefined-builtin
+    character_name=None, feature=None, type=None, # pylint: disable=redefined-builtin
+    publication_year=None, number=None, errata_enable=None, limit=None,
+    ranges: Optional[tuple] = None,
+    columns: Optional[tuple] = None,
+    sort: Optional[str] = None,
+    descending: bool = False,
+    after: Optional[tuple] = None,
+):
+    """
+    Rows (all columns, or just ``columns``) for GET /cards from the configured
+    engine, optionally ordered by ``sort`` and starting after the keyset
+    cursor ``after`` = (sort key, id). ``ranges`` are (column, min, max)
+    filters with inclusive bounds, as returned by range_filters.
+    """
+    if ENGINE == "memory":
+        with stage("store"):
+            rows = get_card_store().select(
+                name=name, rarity=rarity, level=level, round=round,
+                character_name=character_name, feature=feature, type=type,
+                publication_year=publication_year, number=number,
+                errata_enable=errata_enable, limit=limit, ranges=ranges,
+                columns=columns, sort=sort, descending=descending, after=after,
+            )
+        count("rows", len(rows))
+        return rows
+
+    return query_db(*cards_query(
+        name=name, rarity=rarity, level=level, round=round,
+        character_name=character_name, feature=feature, type=type,
+        publication_year=publication_year, number=number,
+        errata_enable=errata_enable, limit=limit, ranges=ranges,
+        columns=columns, sort=sort, descending=descending, after=after,
+    ))
+
+
+def cards_query(
+    name=None, rarity=None, level=None, round=None, # pylint: disable=redefined-builtin
+    character_name=None, feature=None, type=None, # pylint: disable=redefined-builtin
+    publication_year=None, number=None, errata_enable=None, limit=None,
+    ranges: Optional[tuple] = None,
+    columns: Optional[tuple] = None,
+    sort: Optional[str] = None,
+    descending: bool = False,
+    after: Optional[tuple] = None,
+) -> Tuple[str, tuple]:
+    """(SQL, params) of select_cards for the sqlite engine"""
+    filters = []
+    params = []
+
+    if name:
+        filters.append("name")
+        params.append(f"%{name}%")
+    if rarity:
+        filters.append("rarity")
+        params.append(rarity)
+    for column, value in (("level", level), ("round", round)):
+        if not value:
+            continue
+        # whole numbers can use the index on the (integer) column
+        exact = whole_number(value) if column in integer_columns() else None
+        if exact is not None:
+            filters.append(column)
+            params.append(exact)
+        else:
+            filters.append(f"{column}_prefix")
+            params.append(f"{value}%")
+    if character_name:
+        filters.append("character_name")
+        params.append(f"%{character_name}%")
+    if feature:
+        filters.append("feature")
+        params.append(f"%{feature}%")
+    if type:
+        filters.append("type")
+        params.append(f"%{type}%")
+    if publication_year:
+        filters.append("publication_year")
+        params.append(publication_year)
+    if number:
+        filters.append("number")
+        params.append(f"%{number}%")
+    if errata_enable:
+        filters.append("errata_enable")
+    for column, low, high in ranges or ():
+        filters.append(f"{column}_range" if column in integer_columns() else f"{column}_range_text")
+        params.append(INT64_MIN if low is None else clamp_int64(low))
+        params.append(INT64_MAX if high is None else clamp_int64(high))
+
+    if sort and after is not None:
+        params.extend(after)
+    if limit:
+        params.append(limit)
+
+    query = cards_sql(tuple(filters), bool(limit), columns, sort, descending, sort is not None and after is not None)
+    return query, tuple(params)
+
+
+# Deltas touching more than this share of the card pool are answered with
+# the full card list instead
+CHANGES_FULL_RATIO = 0.5
+
+def read_changes(since: str) -> Tuple[Optional[int], Optional[Dict[int, str]]]:
+    """
+    (latest sync id, {card id: its last change after ``since``}) from the
+    card_changes table written by update_card_db.py. ``since`` is a sync id
+    or a data version; the changes are None when they cannot be served as a
+    delta (unknown ``since``, older than the recorded history, or a database
+    without change history).
+    """
+    with db_pool.connection() as conn:
+        try:
+            latest = conn.execute("SELECT MAX(id) FROM sync_log").fetchone()[0]
+            row = conn.execute("SELECT value FROM meta WHERE key = 'changes_from'").fetchone()
+            # a data version made of digits only is still a data version
+            since_id = conn.execute("SELECT MAX(id) FROM sync_log WHERE data_version = ?", (since,)).fetchone()[0]
+            if since_id is None and since.isascii() and since.isdigit():
+                since_id = int(since)
+            if row is None or since_id is None or not int(row["value"]) - 1 <= since_id <= latest:
+                return latest, None
+            changes = {}
+            for change in conn.execute("SELECT card_id, change FROM card_changes WHERE sync_id > ? ORDER BY sync_id", (since_id,)):
+                changes[change["card_id"]] = change["change"]
+        except sqlite3.OperationalError:
+            return None, None
+    return latest, changes
+
+
+# Rows fetched (and encoded) at a time by /cards/export
+EXPORT_BATCH = 500
+
+def iter_card_batches(**kwargs) -> Iterator[List[dict]]:
+    """
+    select_cards in batches of EXPORT_BATCH rows, read from a cursor as they
+    are consumed instead of fetched all at once. The pooled connection stays
+    checked out until the generator finishes or is closed.
+    """
+    if ENGINE == "memory":
+        rows = get_card_store().iter_select(**kwargs)
+        while batch := list(islice(rows, EXPORT_BATCH)):
+            yield batch
+        return
+    query, params = cards_query(**kwargs)
+    with db_pool.connection() as conn:
+        cursor = conn.execute(query, params)
+        while batch := cursor.fetchmany(EXPORT_BATCH):
+            yield [dict(row) for row in batch]
+
+
+def find_card(card_id: str) -> Optional[dict]:
+    """GET /card/{card_id}: first card (by id) whose number contains ``card_id``"""
+    if ENGINE == "memory":
+        return get_card_store().first_by_number(card_id)
+    result = query_db("SELECT * FROM cards WHERE number LIKE ? ORDER BY id LIMIT 1", (f"%{card_id}%",))
+    return result[0] if result else None
+
+
+def resolve_cards(numbers: Sequence[str] = (), ids: Sequence[int] = ()) -> Tuple[List[dict], List[str]]:
+    """
+    Look up a deck list: exact card numbers and ids in a single indexed query.
+    Numbers without an exact match fall back to find_card's substring match;
+    blank ones are missing.
+    Returns the cards in request order (numbers, then ids), each card once,
+    and the requested keys that matched nothing.
+    """
+    numbers = list(dict.fromkeys(numbers))
+    ids = list(dict.fromkeys(ids))
+    by_number: Dict[str, dict] = {}
+    by_id: Dict[int, dict] = {}
+    if ENGINE == "memory":
+        store = get_card_store()
+        by_number = {n: row for n in numbers if (row := store.first_equal("number", n)) is not None}
+        by_id = {i: row for i in ids if (row := store.first_equal("id", i)) is not None}
+    elif numbers or ids:
+        query = (
+            f"SELECT * FROM cards WHERE number IN ({', '.join('?' * len(numbers))})"
+            f" OR id IN ({', '.join('?' * len(ids))}) ORDER BY id"
+        )
+        for row in query_db(query, (*numbers, *ids)):
+            by_number.setdefault(row["number"], row)
+            by_id[row["id"]] = row
+
+    for number in numbers:
+        if number not in by_number and number.strip() and (row := find_card(number)) is not None:
+            by_number[number] = row
+
+    cards: Dict[int, dict] = {}
+    missing = []
+    for key, row in [(n, by_number.get(n)) for n in numbers] + [(i, by_id.get(i)) for i in ids]:
+        if row is None:
+            missing.append(str(key))
+        else:
+            cards.setdefault(row["id"], row)
+    return list(cards.values()), missing
+
+
+def search_rows(q: str, limit: Optional[int], offset: int, highlight: bool, columns: Optional[tuple] = None):
+    """Rows for GET /search: ranked FTS5 matches, or a LIKE scan as fallback"""
+    select = ", ".join(f"cards.{c}" for c in columns) if columns else "cards.*"
+    match = fts_query(q, fts_tokenizer())
+    if match is not None:
+        if highlight:
+            select += ", snippet(cards_fts, -1, '<mark>', '</mark>', '…', 32) AS snippet"
+        query = f"""
+            SELECT {select} FROM cards_fts
+            JOIN cards ON cards.id = cards_fts.rowid
+            WHERE cards_fts MATCH ?
+            ORDER BY bm25(cards_fts, 10.0, 5.0, 1.0, 1.0), cards.id
+            LIMIT ? OFFSET ?
+        """
+        return query_db(query, (match, limit or -1, offset))
+
+    # Short queries (or a database built without cards_fts) use LIKE scans
+    if ENGINE == "memory":
+        rows = get_card_store().search(q, columns)
+        return rows[offset:offset + limit] if limit else rows[offset:]
+
+    query = f"""
+        SELECT {select} FROM cards
+        WHERE name LIKE ? OR effect LIKE ? OR flavor_text LIKE ?
+        LIMIT ? OFFSET ?
+    """
+    like = f"%{q}%"
+    return query_db(query, (like, like, like, limit or -1, offset))
+
+
+# ======================================================
+# Serialization
+# ======================================================
+# With FAST_JSON (the default) every card is validated through Card and
+# encoded once per data version; list endpoints then only look up matching
+# ids and join the pre-encoded bytes. The response_model declarations still
+# document the shape in OpenAPI. NEBULA_FAST_JSON=0 validates rows per request.
+FAST_JSON = os.environ.get("NEBULA_FAST_JSON", "1") == "1"
+
+CARD = TypeAdapter(Card)
+CARD_LIST = TypeAdapter(List[Card])
+SEARCH_RESULT_LIST = TypeAdapter(List[SearchResult])
+
+@cached_per_snapshot
+def encoded_cards() -> Dict[int, bytes]:
+    """Encoded JSON of every card, keyed by id"""
+    return {row["id"]: CARD.dump_json(CARD.validate_python(row)) for row in select_cards()}
+
+def encode_new_card(card_id: int) -> bytes:
+    """
+    A card the loaded snapshot does not have yet: the database was synced
+    and its reload is still running in the background.
+    """
+    return CARD.dump_json(CARD.validate_python(query_db("SELECT * FROM cards WHERE id = ?", (card_id,))[0]))
+
+def encode_card_list(rows) -> bytes:
+    """
+    Join the pre-encoded cards for ``rows`` (dicts with ``id`` and, for
+    highlighted search results, ``snippet``) into a JSON array.
+    """
+    encoded = encoded_cards()
+    with stage("encode"):
+        parts = []
+        for row in rows:
+            card = encoded.get(row["id"]) or encode_new_card(row["id"])
+            if "snippet" in row:
+                card = card[:-1] + b',"snippet":' + json.dumps(row["snippet"], ensure_ascii=False).encode("utf-8") + b"}"
+            parts.append(card)
+        return b"[" + b",".join(parts) + b"]"
+
+
+def encode_cards(rows, projection: Optional[tuple] = None) -> bytes:
+    """JSON array of Card (or of the ``projection`` fields) for full or id-only rows"""
+    adapter = card_projection(projection) if projection else None if FAST_JSON else CARD_LIST
+    if adapter is None:
+        return encode_card_list(rows)
+    with stage("validate"):
+        cards = adapter.validate_python(rows)
+    with stage("encode"):
+        return adapter.dump_json(cards)
+
+
+class ChunkSource:
+    """
+    ``next``/``close`` over a chunk generator advanced on executor threads.
+    A ``close`` while ``next`` is running (the client went away mid-batch)
+    is left to that thread once the batch is done, instead of failing with
+    "generator already executing" and keeping its connection checked out.
+    """
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self.chunks = chunks
+        self._lock = threading.Lock()
+        self._running = False
+        self._closing = False
+
+    def next(self) -> Optional[bytes]:
+        with self._lock:
+            if self._closing:
+                return None
+            self._running = True
+        try:
+            return next(self.chunks, None)
+        finally:
+            with self._lock:
+                self._running = False
+                closing = self._closing
+            if closing:
+                self.chunks.close()
+
+    def close(self):
+        with self._lock:
+            self._closing = True
+            if self._running:
+                return
+        self.chunks.close()
+
+
+# /cards/export formats: media type, download file name
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "cards.ndjson"),
+    "csv": ("text/csv; charset=utf-8", "cards.csv"),
+    "jsonl.gz": ("application/gzip", "cards.jsonl.gz"),
+}
+
+def export_chunks(fmt: str, projection: Optional[tuple], batches: Iterator[List[dict]]) -> Iterator[bytes]:
+    """
+    Encode row batches as NDJSON, CSV or gzipped JSON lines, one chunk per
+    batch; the CSV header is a chunk of its own, sent even without rows
+    """
+    adapter = card_projection(projection) if projection else CARD_LIST
+    fields = projection or tuple(Card.model_fields)
+    gzip = zlib.compressobj(6, zlib.DEFLATED, 31) if fmt == "jsonl.gz" else None
+    text = io.StringIO()
+    writer = csv.writer(text)
+    try:
+        if fmt == "csv":
+            writer.writerow(fields)
+            yield text.getvalue().encode("utf-8")
+            text.seek(0)
+            text.truncate()
+        for batch in batches:
+            with stage("encode"):
+                if fmt == "csv":
+                    writer.writerows([card.model_dump()[f] for f in fields] for card in adapter.validate_python(batch))
+                    chunk = text.getvalue().encode("utf-8")
+                    text.seek(0)
+                    text.truncate()
+                else:
+                    if FAST_JSON and not projection:
+                        encoded = encoded_cards()
+                        lines = [encoded.get(row["id"]) or encode_new_card(row["id"]) for row in batch]
+                    else:
+                        lines = [card.model_dump_json().encode("utf-8") for card in adapter.validate_python(batch)]
+                    chunk = b"\n".join(lines) + b"\n"
+                    if gzip is not None:
+                        chunk = gzip.compress(chunk)
+            if chunk:
+                yield chunk
+        if gzip is not None:
+            yield gzip.flush()
+    finally:
+        batches.close()
+
+
+@lru_cache(maxsize=128)
+def card_projection(fields: tuple) -> TypeAdapter:
+    """List adapter for a Card narrowed to ``fields``, with Card's normalization"""
+    definitions = {field: (Card.model_fields[field].annotation, ...) for field in fields}
+    validators = {}
+    for field in ("level", "round"):
+        if field in fields:
+            validators[f"strip_decimal_{field}"] = field_validator(field, mode="before")(getattr(Card, f"strip_decimal_{field}").__func__)
+    return TypeAdapter(List[create_model("CardProjection", __validators__=validators, **definitions)])
+
+
+# ======================================================
+# Pagination
+# ======================================================
+def parse_sort(sort: Optional[str]) -> Tuple[Optional[str], bool]:
+    """``battle_power_1`` / ``-battle_power_1`` -> (column, descending)"""
+    if not sort:
+        return None, False
+    column = sort.removeprefix("-")
+    if column not in SORT_KEYS:
+        raise HTTPException(status_code=422, detail=f"sort must be one of: {', '.join(SORT_KEYS)} (prefix - for descending)")
+    return column, sort.startswith("-")
+
+def parse_fields(fields: Optional[str]) -> Optional[tuple]:
+    """Comma-separated field list -> tuple of Card fields, in request order"""
+    if not fields:
+        return None
+    requested = tuple(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    unknown = [f for f in requested if f not in Card.model_fields]
+    if unknown or not requested:
+        raise HTTPException(status_code=422, detail=f"Unknown fields: {', '.join(unknown)}")
+    return requested
+
+# Columns GET /cards?facets= can count by
+FACET_COLUMNS = ("rarity", "feature", "type", "character_name", "publication_year", "level", "round", "errata_enable")
+
+# Stored value -> the value Card returns for it, for the facets that differ
+FACET_VALUE = {"level": strip_decimal, "round": strip_decimal, "errata_enable": bool}
+
+def parse_facets(facets: Optional[str]) -> Optional[tuple]:
+    """Comma-separated facet list -> tuple of FACET_COLUMNS, in request order"""
+    if not facets:
+        return None
+    requested = tuple(dict.fromkeys(f.strip() for f in facets.split(",") if f.strip()))
+    unknown = [f for f in requested if f not in FACET_COLUMNS]
+    if unknown or not requested:
+        raise HTTPException(status_code=422, detail=f"Unknown facets: {', '.join(unknown)}")
+    return requested
+
+def encode_cursor(sort: str, key, card_id: int) -> str:
+    raw = json.dumps([sort, key, card_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str, sort: str) -> tuple:
+    """Keyset position (sort key, id) from a cursor issued for the same sort"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, key, card_id = json.loads(raw)
+    except (ValueError, TypeError) as exc:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from exc
+    if cursor_sort != sort or type(card_id) is not int:
+        raise HTTPException(status_code=400, detail="Cursor does not match this sort order")
+    # the key is compared with the sort column's values: it must have their type
+    if type(key) is not (int if SORT_KEYS[sort.lstrip("-")] == "int" else str):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # and be bindable as SQLite integers
+    if any(type(value) is int and clamp_int64(value) != value for value in (key, card_id)):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return key, card_id
+
+
+# ======================================================
+# Response cache
+# ======================================================
+response_cache = ResponseCache.from_env()
+
+async def cached_entry(key: tuple, render) -> Tuple[bytes, Dict[str, str]]:
+    """
+    (body, headers) for ``key`` from the response cache, running ``render()``
+    on db_executor on a miss. ``render`` returns the body, or (body, headers)
+    for responses that carry derived headers such as a pagination cursor.
+    Hits are answered on the event loop.
+    """
+    version = data_version()
+    entry = response_cache.get(key, version)
+    if entry is None:
+        rendered = await db_executor.run(render)
+        entry = rendered if isinstance(rendered, tuple) else (rendered, {})
+        response_cache.put(key, version, *entry)
+    return entry
+
+async def cached_json(key: tuple, render) -> Response:
+    """JSON response for ``key``, see cached_entry"""
+    body, headers = await cached_entry(key, render)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+# Compressed bodies of the responses that only change at sync time (full
+# /cards, /stats, /llms.txt), built once per data version
+precompressed = Precompressed()
+
+async def precompressed_response(request: Request, key: str, body: bytes, media_type: str, headers: Dict[str, str]) -> Response:
+    """
+    ``body`` in the client's preferred Content-Encoding, from ``precompressed``
+    (compressing it on db_executor the first time), or as-is.
+    """
+    encoding = negotiate(request.headers.get("accept-encoding")) if COMPRESSION else None
+    if encoding is None or len(body) < COMPRESS_MIN_BYTES:
+        return Response(content=body, media_type=media_type, headers=headers)
+    version = data_version()
+    variant = precompressed.get(key, version, encoding)
+    if variant is None:
+        variant = await db_executor.run(precompressed.build, key, version, encoding, body)
+    headers = {**headers, "Content-Encoding": encoding, "Vary": "Accept-Encoding"}
+    if "ETag" in headers:
+        headers["ETag"] = encoded_etag(headers["ETag"], encoding)
+    return Response(content=variant, media_type=media_type, headers=headers)
 
 
 # ======================================================
@@ -120,15 +981,39 @@ async def redirect_favicon_svg():
     return RedirectResponse(url="/favicon.ico", status_code=307)
 
 @app.get("/llms.txt", include_in_schema=False)
-async def get_llms_txt():
-    return FileResponse(
-        LLMS_TXT_PATH,
+async def get_llms_txt(request: Request):
+    return await precompressed_response(
+        request, "llms.txt", llms_txt_bytes(),
         media_type="text/plain; charset=utf-8",
-        filename="llms.txt",
+        headers={"Content-Disposition": 'attachment; filename="llms.txt"'},
+    )
+
+def range_filters(
+    bp1_min: Optional[int] = Query(None), bp1_max: Optional[int] = Query(None),
+    bp2_min: Optional[int] = Query(None), bp2_max: Optional[int] = Query(None),
+    bp3_min: Optional[int] = Query(None), bp3_max: Optional[int] = Query(None),
+    bp4_min: Optional[int] = Query(None), bp4_max: Optional[int] = Query(None),
+    bp_ex_min: Optional[int] = Query(None), bp_ex_max: Optional[int] = Query(None),
+    level_min: Optional[int] = Query(None), level_max: Optional[int] = Query(None),
+    round_min: Optional[int] = Query(None), round_max: Optional[int] = Query(None),
+    year_min: Optional[int] = Query(None), year_max: Optional[int] = Query(None),
+) -> Optional[tuple]:
+    """
+    (column, min, max) for each RANGE_PARAMS range given, None without any.
+    Bounds are inclusive; cards with a NULL value never match.
+    """
+    bounds = locals()
+    ranges = tuple(
+        (column, bounds[f"{param}_min"], bounds[f"{param}_max"])
+        for param, column in RANGE_PARAMS.items()
+        if bounds[f"{param}_min"] is not None or bounds[f"{param}_max"] is not None
     )
+    return ranges or None
+
 
 @app.get("/cards", response_model=List[Card])
-def get_cards(
+async def get_cards(
+    request: Request,
     name: Optional[str] = Query(None),
     rarity: Optional[str] = Query(None),
     level: Optional[str] = Query(None),
@@ -139,107 +1024,342 @@ def get_cards(
     publication_year: Optional[int] = Query(None),
     number: str = Query(None),
     errata_enable: bool = Query(None),
-    limit: Optional[int] = Query(None, ge=1)
+    limit: Optional[int] = Query(None, ge=1),
+    sort: Optional[str] = Query(None, description="Sort key, prefix with - for descending: " + ", ".join(SORT_KEYS)),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
+    fields: Optional[str] = Query(None, description="Comma-separated Card fields to return"),
+    numbers: Optional[str] = Query(None, description="Comma-separated card numbers to look up, as in POST /cards/batch"),
+    facets: Optional[str] = Query(None, description="Comma-separated columns to count the matching cards by: " + ", ".join(FACET_COLUMNS)),
+    ranges: Optional[tuple] = Depends(range_filters),
 ):
     """
     Fetch all cards or filter by rarity, level, character name, or feature (Ultra Hero, Kaiju, Scene)
     """
-    query = "SELECT * FROM cards WHERE 1=1"
-    params = []
+    filters = dict(
+        name=name, rarity=rarity, level=level, round=round,
+        character_name=character_name, feature=feature, type=type,
+        publication_year=publication_year, number=number,
+        errata_enable=errata_enable, limit=limit, ranges=ranges,
+    )
+    projection = parse_fields(fields)
+    facet_columns = parse_facets(facets)
+    if numbers is not None:
+        return await get_cards_by_numbers(numbers, projection, conflicting=any(filters.values()) or bool(sort or cursor or facets))
 
-    if name:
-        query += " AND name LIKE ?"
-        params.append(f"%{name}%")
-    if rarity:
-        query += " AND rarity = ? COLLATE NOCASE"
-        params.append(rarity)
-    if level:
-        query += " AND level LIKE ?"
-        params.append(f"{level}%")
-    if round:
-        query += " AND round LIKE ?"
-        params.append(f"{round}%")
-    if character_name:
-        query += " AND character_name LIKE ?"
-        params.append(f"%{character_name}%")
-    if feature:
-        query += " AND feature LIKE ?"
-        params.append(f"%{feature}%")
-    if type:
-        query += " AND type LIKE ?"
-        params.append(f"%{type}%")
-    if publication_year:
-        query += " AND publication_year = ?"
-        params.append(publication_year)
-    if number:
-        query += " AND number LIKE ?"
-        params.append(f"%{number}%")
-    if errata_enable:
-        query += " AND errata_enable = ?"
-        params.append(1 if errata_enable else 0)
+    sort_key, descending = parse_sort(sort)
+    after = decode_cursor(cursor, sort or "id") if cursor else None
+    if after is not None and sort_key is None:
+        sort_key = "id"
+    key = ("cards",) + normalize_params(**filters, sort=sort, fields=projection, facets=facet_columns) + (("cursor", cursor),)
+
+    def render():
+        if projection:
+            columns = projection if "id" in projection else projection + ("id",)
+        else:
+            columns = ("id",) if FAST_JSON else None
+        rows = select_cards(**filters, columns=columns, sort=sort_key, descending=descending, after=after)
+        body = encode_cards(rows, projection)
+        if facet_columns:
+            body = encode_facets(filters, facet_columns, body)
+        headers = {}
+        if limit and len(rows) == limit:
+            last = rows[-1]
+            token = encode_cursor(sort or "id", last.get("_sort", last["id"]), last["id"])
+            next_url = request.url.include_query_params(cursor=token)
+            headers["X-Next-Cursor"] = token
+            headers["Link"] = f'<{next_url.path}?{next_url.query}>; rel="next"'
+        return body, headers
+
+    if key == ("cards", ("cursor", None)):
+        # the full card list: served precompressed
+        body, headers = await cached_entry(key, render)
+        return await precompressed_response(request, "cards", body, "application/json", headers)
+
+    return await cached_json(key, render)
+
+
+def encode_facets(filters: dict, columns: tuple, cards: bytes) -> bytes:
+    """
+    ``{"total": n, "facets": {column: [{"value": v, "count": n}, ...]}, "cards": [...]}``
+    for GET /cards?facets=. Counts cover every card matching the filters
+    (not just the page in ``cards``) and come from the CardStore's per-value
+    bitmaps in both engines: one AND + popcount per distinct value.
+    """
+    store = get_card_store()
+    with stage("facets"):
+        mask = store.filter_mask(**{k: v for k, v in filters.items() if k != "limit"})
+        counts = {
+            column: [{"value": FACET_VALUE.get(column, lambda v: v)(value), "count": n} for value, n in pairs]
+            for column, pairs in store.facets(mask, columns).items()
+        }
+        head = json.dumps({"total": mask.bit_count(), "facets": counts}, ensure_ascii=False)
+    return head[:-1].encode("utf-8") + b',"cards":' + cards + b"}"
+
+
+async def get_cards_by_numbers(numbers: str, projection: Optional[tuple], conflicting: bool) -> Response:
+    """GET /cards?numbers=...: resolve_cards, with misses percent-encoded in X-Missing-Cards"""
+    if conflicting:
+        raise HTTPException(status_code=422, detail="numbers cannot be combined with other filters, sort or cursor")
+    requested = [n.strip() for n in numbers.split(",") if n.strip()]
+    if len(requested) > BATCH_MAX:
+        raise HTTPException(status_code=422, detail=f"At most {BATCH_MAX} numbers per request")
+    # card numbers match exactly first, so the key is case-sensitive
+    key = ("cards", ("numbers", tuple(requested)), ("fields", projection))
+
+    def render():
+        cards, missing = resolve_cards(requested)
+        # percent-encoded: header values are latin-1, card numbers may not be
+        headers = {"X-Missing-Cards": ",".join(quote(n, safe="") for n in missing)} if missing else {}
+        return encode_cards(cards, projection), headers
+
+    return await cached_json(key, render)
+
+
+@app.get("/cards/export")
+async def export_cards(
+    format: str = Query("ndjson", description="ndjson, csv or jsonl.gz"), # pylint: disable=redefined-builtin
+    name: Optional[str] = Query(None),
+    rarity: Optional[str] = Query(None),
+    level: Optional[str] = Query(None),
+    round: Optional[str] = Query(None), # pylint: disable=redefined-builtin
+    character_name: Optional[str] = Query(None),
+    feature: Optional[str] = Query(None),
+    type: Optional[str] = Query(None), # pylint: disable=redefined-builtin
+    publication_year: Optional[int] = Query(None),
+    number: str = Query(None),
+    errata_enable: bool = Query(None),
+    limit: Optional[int] = Query(None, ge=1),
+    sort: Optional[str] = Query(None, description="Sort key, prefix with - for descending: " + ", ".join(SORT_KEYS)),
+    fields: Optional[str] = Query(None, description="Comma-separated Card fields to export"),
+    ranges: Optional[tuple] = Depends(range_filters),
+):
+    """
+    Stream the cards matching the GET /cards filters as NDJSON, CSV or gzipped
+    JSON lines, a batch at a time, without building the whole result first
+    """
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=422, detail=f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    projection = parse_fields(fields)
+    sort_key, descending = parse_sort(sort)
+    if projection:
+        columns = projection if "id" in projection else projection + ("id",)
+    else:
+        columns = ("id",) if FAST_JSON and format != "csv" else None
+    chunks = export_chunks(format, projection, iter_card_batches(
+        name=name, rarity=rarity, level=level, round=round,
+        character_name=character_name, feature=feature, type=type,
+        publication_year=publication_year, number=number,
+        errata_enable=errata_enable, limit=limit, ranges=ranges,
+        columns=columns, sort=sort_key, descending=descending,
+    ))
+    source = ChunkSource(chunks)
+    # the first chunk is produced before the response starts, so a busy
+    # executor still turns into a 503
+    try:
+        first = await db_executor.run(source.next)
+    except BaseException:
+        source.close()
+        raise
+
+    async def stream():
+        try:
+            chunk = first
+            while chunk is not None:
+                yield chunk
+                while True:
+                    try:
+                        chunk = await db_executor.run(source.next)
+                        break
+                    except Overloaded:
+                        await asyncio.sleep(0.05)
+        finally:
+            source.close()
+
+    media_type, filename = EXPORT_FORMATS[format]
+    return StreamingResponse(stream(), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
 
-    if limit:
-        query += " LIMIT ?"
-        params.append(limit)
 
-    return query_db(query, tuple(params))
+@app.get("/cards/changes")
+async def get_card_changes(since: str = Query(..., description="version of the previous response, or an X-Data-Version value")):
+    """
+    Cards inserted, updated or deleted since an earlier sync, for clients that
+    keep a local copy; the full card list when the delta cannot be served
+    """
+    key = ("changes", since)
+
+    def render():
+        latest, changes = read_changes(since)
+        full = changes is None or len(changes) > CHANGES_FULL_RATIO * len(encoded_cards())
+        columns = ("id",) if FAST_JSON else None
+        if full:
+            rows, deleted = select_cards(columns=columns), []
+        else:
+            upserted = sorted(card_id for card_id, change in changes.items() if change != "deleted")
+            deleted = sorted(card_id for card_id, change in changes.items() if change == "deleted")
+            rows = query_db(
+                f"SELECT {', '.join(columns or ('*',))} FROM cards WHERE id IN ({', '.join('?' * len(upserted))}) ORDER BY id",
+                tuple(upserted),
+            ) if upserted else []
+        head = json.dumps({"version": latest, "data_version": data_version(), "full": full, "deleted": deleted})
+        return head[:-1].encode("utf-8") + b',"cards":' + encode_cards(rows) + b"}"
+
+    return await cached_json(key, render)
+
+
+@app.post("/cards/batch", response_model=CardBatch)
+async def get_cards_batch(batch: CardBatchRequest):
+    """
+    Resolve a deck list of card numbers and/or ids in one request. Cards come
+    back in request order without duplicates; unknown keys are listed in missing.
+    """
+    def render():
+        cards, missing = resolve_cards(batch.numbers, batch.ids)
+        if FAST_JSON:
+            body = b'{"cards":' + encode_card_list(cards) + b',"missing":' + json.dumps(missing, ensure_ascii=False).encode("utf-8") + b"}"
+            return Response(content=body, media_type="application/json")
+        return {"cards": cards, "missing": missing}
+
+    return await db_executor.run(render)
+
+
+def analyze_decks(decks: List[DeckRequest]) -> List[dict]:
+    store = get_card_store()
+    with stage("analyze"):
+        return [
+            {"name": deck.name, **analyze_deck(store, ((e.number, e.quantity) for e in deck.cards))}
+            for deck in decks
+        ]
+
+
+@app.post("/decks/analyze", response_model=DeckAnalysis)
+async def analyze_deck_stats(deck: DeckRequest):
+    """
+    Level and round curves, feature/type/rarity/character mix and battle
+    power totals of a deck given as card numbers with quantities
+    """
+    return (await db_executor.run(analyze_decks, [deck]))[0]
+
+
+@app.post("/decks/analyze/bulk", response_model=BulkDeckAnalysis)
+async def analyze_deck_stats_bulk(batch: BulkDeckRequest):
+    """POST /decks/analyze for many decks at once, in request order"""
+    return {"decks": await db_executor.run(analyze_decks, batch.decks)}
 
 
 @app.get("/card/{card_id}", response_model=Card)
-def get_card(card_id: str):
+async def get_card(card_id: str):
     """Fetch a single card by Number"""
-    result = query_db("SELECT * FROM cards WHERE number LIKE ?", (f"%{card_id}%",))
-    if not result:
-        return {"error": "Card not found"}
-    return result[0]
+    def render():
+        card = find_card(card_id)
+        if card is None:
+            return {"error": "Card not found"}
+        if FAST_JSON:
+            body = encoded_cards().get(card["id"]) or encode_new_card(card["id"])
+            return Response(content=body, media_type="application/json")
+        return card
 
+    return await db_executor.run(render)
+
+
+@app.get("/search", response_model=List[SearchResult], response_model_exclude_unset=True)
+async def search_cards(
+    q: str,
+    limit: Optional[int] = Query(None, ge=1),
+    offset: int = Query(0, ge=0),
+    highlight: bool = Query(False),
+):
+    """Search by card name, ruby, effect or flavor text, best matches first"""
+    key = ("search",) + normalize_params(q=q, limit=limit, offset=offset, highlight=highlight)
+
+    def render():
+        if FAST_JSON:
+            return encode_card_list(search_rows(q, limit, offset, highlight, columns=("id",)))
+        rows = search_rows(q, limit, offset, highlight)
+        return SEARCH_RESULT_LIST.dump_json(SEARCH_RESULT_LIST.validate_python(rows), exclude_unset=True)
+
+    return await cached_json(key, render)
 
-@app.get("/search", response_model=List[Card])
-def search_cards(q: str):
-    """Search by card name or effect text"""
-    query = """
-        SELECT * FROM cards
-        WHERE name LIKE ? OR effect LIKE ? OR flavor_text LIKE ?
-    """
-    like = f"%{q}%"
-    return query_db(query, (like, like, like))
+
+@app.get("/suggest", response_model=List[Suggestion])
+async def suggest(
+    q: str,
+    limit: int = Query(10, ge=1, le=SUGGEST_MAX),
+    fuzzy: bool = Query(False, description="Also match values one typo away"),
+):
+    """Autocomplete card names, character names, ruby and card numbers from a prefix"""
+    key = ("suggest",) + normalize_params(q=q, limit=limit, fuzzy=fuzzy)
+
+    def render():
+        with stage("suggest"):
+            return json.dumps(suggest_index().suggest(q, limit, fuzzy), ensure_ascii=False).encode("utf-8")
+
+    return await cached_json(key, render)
 
 
 @app.get("/stats")
-def get_stats():
+async def get_stats(request: Request):
     """Return database statistics like total card count and counts by rarity/type"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    body, etag = await db_executor.run(stats_snapshot)
+    encoding = negotiate(request.headers.get("accept-encoding")) if COMPRESSION and len(body) >= COMPRESS_MIN_BYTES else None
+    if_none_match = request.headers.get("if-none-match")
+    if etag_matches(if_none_match, etag) or etag_matches(if_none_match, encoded_etag(etag, encoding)):
+        return Response(status_code=304, headers={"ETag": encoded_etag(etag, encoding)})
+    return await precompressed_response(request, "stats", body, "application/json", {"ETag": etag})
 
-    cursor.execute("SELECT COUNT(*) FROM cards")
-    total = cursor.fetchone()[0]
 
-    cursor.execute("SELECT rarity, COUNT(*) FROM cards GROUP BY rarity")
-    rarity_counts = {r: c for r, c in cursor.fetchall()}
+ADMIN_TOKEN = os.environ.get("NEBULA_ADMIN_TOKEN")
 
-    cursor.execute("SELECT feature, COUNT(*) FROM cards GROUP BY feature")
-    feature_counts = {r: c for r, c in cursor.fetchall()}
+def require_admin(request: Request):
+    """Bearer-token check for /admin endpoints (disabled without NEBULA_ADMIN_TOKEN)"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not secrets.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token", headers={"WWW-Authenticate": "Bearer"})
 
-    cursor.execute("SELECT type, COUNT(*) FROM cards WHERE type IS NOT NULL GROUP BY type")
-    type_counts = {r: c for r, c in cursor.fetchall()}
 
-    cursor.execute("SELECT publication_year, COUNT(*) FROM cards WHERE publication_year IS NOT NULL GROUP BY publication_year ORDER BY publication_year ASC")
-    year_counts = {r: c for r, c in cursor.fetchall()}
+@app.post("/admin/reload", include_in_schema=False)
+async def admin_reload(request: Request):
+    """Reload the card data in this worker now and drop cached responses"""
+    require_admin(request)
+    snapshot = await db_executor.run(lambda: data_reloader.reload(force=True))
+    response_cache.clear()
+    return {"data_version": snapshot.version, **data_reloader.stats()}
 
-    cursor.execute("SELECT character_name, COUNT(*) FROM cards WHERE character_name <> '-' AND feature = 'Ultra Hero' GROUP BY character_name ORDER BY COUNT(*) DESC LIMIT 25")
-    top_ultras = {r: c for r, c in cursor.fetchall()}
 
-    cursor.execute("SELECT character_name, COUNT(*) FROM cards WHERE character_name <> '-' AND feature = 'Kaiju' GROUP BY character_name ORDER BY COUNT(*) DESC LIMIT 25")
-    top_kaiju = {r: c for r, c in cursor.fetchall()}
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """Request, stage, size and row-count histograms in Prometheus text format"""
+    return Response(content=metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/debug/cache", include_in_schema=False)
+def get_cache_stats():
+    """Response cache and precompressed body counters"""
+    return {
+        "data_version": data_version(),
+        "reload": data_reloader.stats(),
+        "response_cache": response_cache.stats(),
+        "precompressed": precompressed.stats(),
+    }
 
-    conn.close()
 
+@app.get("/debug/pool", include_in_schema=False)
+def get_pool_stats():
+    """Connection pool, executor and SQL string cache counters"""
+    sql_cache = cards_sql.cache_info()
+    lookups = sql_cache.hits + sql_cache.misses
     return {
-        "total_cards": total,
-        "rarity_distribution": rarity_counts,
-        "feature_distribution": feature_counts,
-        "type_distribution": type_counts,
-        "publication_year_distribution": year_counts,
-        "top_25_ultras": top_ultras,
-        "top_25_kaiju": top_kaiju,
+        "engine": ENGINE,
+        "card_store": data_snapshot().store_source,
+        "pool": db_pool.stats(),
+        "executor": db_executor.stats(),
+        "sql_cache": {
+            "size": sql_cache.currsize,
+            "maxsize": sql_cache.maxsize,
+            "hits": sql_cache.hits,
+            "misses": sql_cache.misses,
+            "hit_rate": round(sql_cache.hits / lookups, 4) if lookups else 0.0,
+        },
     }
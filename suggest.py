@@ -0,0 +1,158 @@
+"""
+Autocomplete index behind ``GET /suggest``.
+
+Every distinct value of the suggested columns (``name``, ``character_name``,
+``ruby``, ``number``) is indexed under each of its word starts, normalized
+(NFKC + casefold): "Ultraman Tiga" under ``ultraman tiga`` and ``tiga``,
+"AP(05/20)BP05-002" under ``ap(05/20)bp05-002``, ``bp05-002``, ``002``, ...
+The keys live in one sorted list, so a query is a ``bisect`` for the range
+of keys it prefixes. Matches rank by a score fixed at build time (value
+starts with the query, then card count, then shorter values), and the top
+results of every 1- and 2-character prefix are precomputed because those
+ranges are the large ones.
+
+With ``fuzzy``, queries of at least 3 characters that leave room in the
+result also match text values whose word starts are one edit (insert,
+delete, substitute, or swap of two adjacent characters) away from the
+query. Insert/delete/substitute candidates come from a bigram index over
+the keys: such an edit changes at most two of the query's bigrams, so a
+key must share all but two of them before the edit distance is checked.
+Swaps are looked up directly, as one prefix range per swapped variant of
+the query.
+"""
+import heapq
+import re
+import unicodedata
+from bisect import bisect_left
+from collections import Counter
+from typing import Any, Dict, List, Sequence, Tuple
+
+from card_store import CardStore, DictColumn
+
+SUGGEST_COLUMNS = ("name", "character_name", "ruby", "number")
+
+# Typos are corrected in text, not card numbers
+FUZZY_COLUMNS = ("name", "character_name", "ruby")
+
+# Placeholder values that are never suggested
+EMPTY_VALUES = ("", "-")
+
+PRECOMPUTED_PREFIX = 2
+MAX_LIMIT = 50
+
+_WORD_START = re.compile(r"(?<![^\W_])[^\W_]")
+
+
+def normalize(text: str) -> str:
+    return unicodedata.normalize("NFKC", text).casefold()
+
+
+def bigrams(text: str) -> set:
+    padded = "^" + text
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+
+def prefix_within_one_edit(query: str, key: str) -> bool:
+    """Whether some prefix of ``key`` is at most one edit away from ``query``."""
+    n = len(query)
+    for length in (n, n - 1, n + 1):
+        if length <= 0 or length > len(key):
+            continue
+        prefix = key[:length]
+        if length == n:
+            if sum(a != b for a, b in zip(query, prefix)) <= 1:
+                return True
+        else:
+            longer, shorter = (query, prefix) if n > length else (prefix, query)
+            i = 0
+            while i < len(shorter) and longer[i] == shorter[i]:
+                i += 1
+            if longer[i + 1:] == shorter[i:]:
+                return True
+    return False
+
+
+class SuggestIndex:
+    """Sorted word-start keys over the distinct values of SUGGEST_COLUMNS."""
+
+    def __init__(self, entries: List[Dict[str, Any]], pairs: List[Tuple[str, tuple, int]]):
+        # entries: suggestion payloads; pairs: (key, static score, entry index)
+        self.entries = entries
+        pairs.sort()
+        self.keys = [key for key, _, _ in pairs]
+        self.pairs = [(score, entry) for _, score, entry in pairs]
+        self._short: Dict[str, List[int]] = {}
+        for i, key in enumerate(self.keys):
+            for length in range(1, PRECOMPUTED_PREFIX + 1):
+                if len(key) >= length:
+                    self._short.setdefault(key[:length], []).append(i)
+        self._short = {prefix: self._top(positions, MAX_LIMIT) for prefix, positions in self._short.items()}
+        self._grams: Dict[str, List[int]] = {}
+        for i, key in enumerate(self.keys):
+            if self.entries[self.pairs[i][1]]["field"] in FUZZY_COLUMNS:
+                for gram in bigrams(key):
+                    self._grams.setdefault(gram, []).append(i)
+
+    @classmethod
+    def from_store(cls, store: CardStore) -> "SuggestIndex":
+        entries: List[Dict[str, Any]] = []
+        pairs: List[Tuple[str, tuple, int]] = []
+        numbers = store.columns["number"]
+        for field in SUGGEST_COLUMNS:
+            column = store.columns[field]
+            if not isinstance(column, DictColumn):
+                continue
+            for value, postings in zip(column.dictionary, column.postings):
+                if not isinstance(value, str) or value.strip() in EMPTY_VALUES:
+                    continue
+                first = (postings & -postings).bit_length() - 1
+                entry = len(entries)
+                cards = postings.bit_count()
+                entries.append({"value": value, "field": field, "cards": cards, "number": numbers.get(first)})
+                text = normalize(value)
+                for match in _WORD_START.finditer(text):
+                    start = match.start()
+                    pairs.append((text[start:], (start > 0, -cards, len(value), value, field), entry))
+        return cls(entries, pairs)
+
+    def _top(self, positions, limit: int) -> List[int]:
+        """Positions of the best-scored distinct entries among ``positions``."""
+        best: Dict[int, Tuple[tuple, int]] = {}
+        for i in positions:
+            score, entry = self.pairs[i]
+            if entry not in best or score < best[entry][0]:
+                best[entry] = (score, i)
+        return [i for _, i in heapq.nsmallest(limit, best.values())]
+
+    def suggest(self, q: str, limit: int = 10, fuzzy: bool = False) -> List[Dict[str, Any]]:
+        query = normalize(q).strip()
+        if not query:
+            return []
+        limit = min(limit, MAX_LIMIT)
+        if len(query) <= PRECOMPUTED_PREFIX:
+            positions: Sequence[int] = self._short.get(query, ())[:limit]
+        else:
+            positions = self._top(self._range(query), limit)
+        results = [self.entries[self.pairs[i][1]] for i in positions]
+        if fuzzy and len(results) < limit and len(query) >= 3:
+            seen = {id(entry) for entry in results}
+            results += [e for e in self._fuzzy(query, limit) if id(e) not in seen][:limit - len(results)]
+        return results
+
+    def _range(self, prefix: str) -> range:
+        lo = bisect_left(self.keys, prefix)
+        return range(lo, bisect_left(self.keys, prefix + "\U0010ffff", lo))
+
+    def _fuzzy(self, query: str, limit: int) -> List[Dict[str, Any]]:
+        grams = bigrams(query)
+        shared: Counter = Counter()
+        for gram in grams:
+            shared.update(self._grams.get(gram, ()))
+        needed = len(grams) - 2
+        candidates = [i for i, n in shared.items() if n >= needed and prefix_within_one_edit(query, self.keys[i])]
+        for i in range(len(query) - 1):
+            if query[i] != query[i + 1]:
+                swapped = query[:i] + query[i + 1] + query[i] + query[i + 2:]
+                candidates += [j for j in self._range(swapped)
+                               if self.entries[self.pairs[j][1]]["field"] in FUZZY_COLUMNS]
+        return [self.entries[self.pairs[i][1]] for i in self._top(candidates, limit)]
@@ -1,3 +1,4 @@
+import os
 import pytest
 from fastapi.exceptions import ResponseValidationError
 from fastapi.testclient import TestClient
@@ -382,3 +383,983 @@ def test_stats_totals_match_database_snapshot():
         "2024": 67,
         "2025": 79,
     }
+
+
+def get_after_reload(path: str):
+    """GET ``path`` once the reload a data change triggers (in the background) has finished."""
+    import nebula_api
+    client.get(path)
+    nebula_api.data_reloader.wait()
+    return client.get(path)
+
+
+@pytest.fixture
+def memory_engine(monkeypatch):
+    """Serve requests from the in-memory CardStore instead of SQLite."""
+    import nebula_api
+    monkeypatch.setattr(nebula_api, "ENGINE", "memory")
+    nebula_api.response_cache.clear()
+    yield
+    nebula_api.response_cache.clear()
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        "/cards",
+        "/cards?limit=7",
+        "/cards?rarity=rrr",
+        "/cards?level=3&feature=Ultra",
+        "/cards?round=1",
+        "/cards?character_name=zero&type=SPEED",
+        "/cards?name=Tiga&publication_year=1996",
+        "/cards?number=BP01-00_",
+        "/cards?errata_enable=true",
+        "/cards?feature=Kaiju&limit=5",
+        "/card/BP04-031",
+        "/card/PR-001",
+        "/search?q=draw two cards",
+        "/search?q=Gaia",
+        "/stats",
+    ],
+)
+def test_memory_engine_matches_sqlite(path, monkeypatch):
+    """The columnar store must return exactly what the SQL queries return."""
+    import nebula_api
+    nebula_api.response_cache.clear()
+    expected = client.get(path).json()
+    monkeypatch.setattr(nebula_api, "ENGINE", "memory")
+    nebula_api.response_cache.clear()
+    assert client.get(path).json() == expected
+
+
+def test_memory_engine_card_not_found(memory_engine):
+    """Missing card numbers behave the same on the in-memory engine."""
+    with pytest.raises(ResponseValidationError):
+        client.get("/card/DOES-NOT-EXIST-999")
+
+
+def test_pool_reuses_connections_and_sql_strings():
+    """Repeated filter combinations reuse pooled connections and cached SQL."""
+    client.get("/cards?rarity=RRR&limit=2")
+    before = client.get("/debug/pool").json()
+    for limit in (3, 4, 5):
+        client.get(f"/cards?rarity=RRR&limit={limit}")
+    after = client.get("/debug/pool").json()
+    assert after["pool"]["hits"] >= before["pool"]["hits"] + 3
+    assert after["pool"]["opened"] == before["pool"]["opened"]
+    assert after["sql_cache"]["hits"] >= before["sql_cache"]["hits"] + 3
+    assert 0 < after["pool"]["size"] <= after["pool"]["max_size"]
+
+
+def test_pooled_connections_are_read_only():
+    """Pooled connections are opened with mode=ro."""
+    import sqlite3
+    from nebula_api import db_pool
+    with db_pool.connection() as conn, pytest.raises(sqlite3.OperationalError):
+        conn.execute("DELETE FROM cards")
+
+
+def test_search_matches_partial_words_ranked_by_name():
+    """Partial words match through the FTS index and name hits rank first."""
+    response = client.get("/search?q=Gai&limit=5")
+    assert response.status_code == 200
+    cards = response.json()
+    assert 0 < len(cards) <= 5
+    assert "gai" in cards[0]["name"].lower()
+    assert all("snippet" not in card for card in cards)
+
+
+def test_search_limit_offset_pages_through_results():
+    """limit/offset page through the same ranked result list."""
+    full = [card["id"] for card in client.get("/search?q=attack").json()]
+    page = [card["id"] for card in client.get("/search?q=attack&limit=3&offset=2").json()]
+    assert page == full[2:5]
+
+
+def test_search_highlight_returns_snippets():
+    """highlight=true adds a marked-up snippet to every hit."""
+    response = client.get("/search?q=draw two cards&highlight=true&limit=3")
+    assert response.status_code == 200
+    cards = response.json()
+    assert cards
+    for card in cards:
+        assert "<mark>" in card["snippet"].lower()
+
+
+def test_search_short_query_falls_back_to_like():
+    """Queries shorter than a trigram still search via LIKE."""
+    response = client.get("/search?q=Z&limit=3")
+    assert response.status_code == 200
+    assert len(response.json()) == 3
+
+
+def test_stats_served_with_strong_etag_and_304():
+    """/stats carries a strong ETag and answers If-None-Match with 304."""
+    response = client.get("/stats")
+    etag = response.headers["etag"]
+    assert etag.startswith('"')
+    cached = client.get("/stats", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert client.get("/stats", headers={"If-None-Match": '"stale"'}).status_code == 200
+
+
+def test_stats_includes_sync_time_aggregates():
+    """The precomputed snapshot carries per-set, illustrator and BP histograms."""
+    stats = client.get("/stats").json()
+    assert sum(stats["set_distribution"].values()) == stats["total_cards"]
+    assert stats["illustrator_distribution"]
+    histogram = stats["battle_power_histograms"]["battle_power_1"]
+    assert all(int(bucket) % 1000 == 0 for bucket in histogram)
+
+
+def test_stats_falls_back_without_stats_table(tmp_path, monkeypatch):
+    """Databases built before the stats table still get the same payload."""
+    import shutil
+    import sqlite3
+    import nebula_api
+    from db_pool import ConnectionPool
+    expected = client.get("/stats").json()
+    db_copy = tmp_path / "cards.db"
+    shutil.copy(nebula_api.DB_PATH, db_copy)
+    with sqlite3.connect(db_copy) as conn:
+        conn.execute("DROP TABLE stats")
+    monkeypatch.setattr(nebula_api, "DB_PATH", str(db_copy))
+    monkeypatch.setattr(nebula_api, "db_pool", ConnectionPool(db_copy))
+    assert client.get("/stats").json() == expected
+
+
+@pytest.mark.parametrize("path", ["/cards?rarity=RRR", "/card/BP04-031", "/search?q=Gaia", "/llms.txt"])
+def test_responses_carry_version_validators(path):
+    """Card data endpoints emit a version ETag and Cache-Control."""
+    response = client.get(path)
+    assert response.status_code == 200
+    assert response.headers["etag"].startswith('W/"')
+    assert "max-age" in response.headers["cache-control"]
+
+
+def test_conditional_request_skips_the_database(monkeypatch):
+    """A matching If-None-Match is answered with 304 before any query runs."""
+    import nebula_api
+    etag = client.get("/cards?limit=3").headers["etag"]
+
+    def fail(*_args, **_kwargs):
+        raise AssertionError("database queried for a 304")
+
+    monkeypatch.setattr(nebula_api, "query_db", fail)
+    response = client.get("/cards?limit=3", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.content == b""
+
+
+def test_etag_changes_with_data_version(monkeypatch):
+    """A new data version invalidates previously issued ETags."""
+    import nebula_api
+    etag = client.get("/cards?limit=3").headers["etag"]
+    monkeypatch.setattr(nebula_api, "data_version", lambda: "next-sync")
+    response = client.get("/cards?limit=3", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+def test_response_cache_serves_repeated_queries():
+    """Equivalent filter combinations hit the cache and skip the query."""
+    import nebula_api
+    nebula_api.response_cache.clear()
+    first = client.get("/cards?character_name=TIGA&rarity=RRR")
+    before = client.get("/debug/cache").json()["response_cache"]
+    second = client.get("/cards?rarity=rrr&character_name=tiga")
+    after = client.get("/debug/cache").json()["response_cache"]
+    assert second.content == first.content
+    assert after["hits"] == before["hits"] + 1
+    assert after["bytes"] >= len(first.content)
+
+
+def test_response_cache_lru_eviction_and_version_invalidation():
+    """The cache evicts least recently used bodies and drops stale versions."""
+    from http_cache import ResponseCache
+    cache = ResponseCache(max_bytes=10)
+    cache.put("a", "v1", b"aaaa")
+    cache.put("b", "v1", b"bbbb")
+    assert cache.get("a", "v1") == (b"aaaa", {})
+    cache.put("c", "v1", b"cccc", {"X-Next-Cursor": "abc"})
+    assert cache.get("b", "v1") is None
+    assert cache.get("a", "v1") == (b"aaaa", {})
+    assert cache.get("c", "v1") == (b"cccc", {"X-Next-Cursor": "abc"})
+    assert cache.stats()["evictions"] == 1
+    assert cache.get("a", "v2") is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_response_cache_ttl_expiry():
+    """Entries older than the TTL are misses."""
+    from http_cache import ResponseCache
+    now = [0.0]
+    cache = ResponseCache(ttl=5, clock=lambda: now[0])
+    cache.put("a", "v1", b"body")
+    now[0] = 6.0
+    assert cache.get("a", "v1") is None
+    assert cache.stats()["expirations"] == 1
+
+
+@pytest.mark.parametrize(
+    "path",
+    ["/cards", "/cards?feature=Kaiju&limit=4", "/card/BP04-031",
+     "/search?q=Gaia&limit=5", "/search?q=draw two cards&highlight=true", "/search?q=Z"],
+)
+def test_fast_json_matches_validated_serialization(path, monkeypatch):
+    """Pre-encoded cards produce the same JSON as per-request validation."""
+    import nebula_api
+    nebula_api.response_cache.clear()
+    fast = client.get(path)
+    monkeypatch.setattr(nebula_api, "FAST_JSON", False)
+    nebula_api.response_cache.clear()
+    slow = client.get(path)
+    nebula_api.response_cache.clear()
+    assert fast.status_code == slow.status_code == 200
+    assert fast.json() == slow.json()
+
+
+@pytest.mark.parametrize("path", ["/card/BP04-031", "/cards?number=BP04-031", "/cards/export?number=BP04-031"])
+def test_cards_missing_from_loaded_snapshot_are_encoded_from_database(path, monkeypatch):
+    """A card synced in while its reload still runs is served, not a 500."""
+    import nebula_api
+    nebula_api.response_cache.clear()
+    expected = client.get(path)
+    monkeypatch.setattr(nebula_api, "encoded_cards", lambda: {})
+    nebula_api.response_cache.clear()
+    response = client.get(path)
+    nebula_api.response_cache.clear()
+    assert response.status_code == expected.status_code == 200
+    assert response.content == expected.content
+
+
+def _walk_pages(path):
+    """Follow X-Next-Cursor links until the last page."""
+    cards = []
+    response = client.get(path)
+    while True:
+        assert response.status_code == 200
+        cards.extend(response.json())
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            return cards
+        response = client.get(f"{path}&cursor={cursor}")
+
+
+@pytest.mark.parametrize("sort", ["id", "-battle_power_1", "level", "-publication_year", "number"])
+def test_cursor_pagination_walks_every_card_once(sort):
+    """Keyset pages cover the filtered set exactly once, in sort order."""
+    cards = _walk_pages(f"/cards?feature=Ultra Hero&sort={sort}&limit=97&fields=id,level,number,battle_power_1,publication_year")
+    expected = client.get("/cards?feature=Ultra Hero").json()
+    assert sorted(card["id"] for card in cards) == sorted(card["id"] for card in expected)
+    column = sort.lstrip("-")
+    values = [card[column] if column != "level" else int(card["level"]) if card["level"] else None for card in cards]
+    present = [v for v in values if v is not None]
+    assert present == sorted(present, reverse=sort.startswith("-"))
+    assert all(v is None for v in values[len(present):]), "NULL sort keys come last"
+
+
+def test_cursor_pagination_memory_engine_matches_sqlite(monkeypatch):
+    """Both engines produce the same pages and cursors."""
+    import nebula_api
+    path = "/cards?rarity=R&sort=-battle_power_2&limit=20"
+    nebula_api.response_cache.clear()
+    expected = _walk_pages(path)
+    monkeypatch.setattr(nebula_api, "ENGINE", "memory")
+    nebula_api.response_cache.clear()
+    assert _walk_pages(path) == expected
+
+
+def test_fields_projection_narrows_cards():
+    """fields= returns only the requested keys, still normalized."""
+    response = client.get("/cards?number=BP04-031&fields=number,level,thumbnail_image_url")
+    assert response.status_code == 200
+    assert response.json() == [{
+        "number": "BP04-031",
+        "level": "3",
+        "thumbnail_image_url": client.get("/card/BP04-031").json()["thumbnail_image_url"],
+    }]
+
+
+@pytest.mark.parametrize("engine", ["sqlite", "memory"])
+def test_level_prefix_of_a_whole_number_matches_it(engine, monkeypatch):
+    """level=1. and level=1.0 (prefixes of the old "1.0" text) match level 1."""
+    import nebula_api
+    monkeypatch.setattr(nebula_api, "ENGINE", engine)
+    expected = client.get("/cards?level=1&fields=id").json()
+    assert expected
+    assert client.get("/cards?level=1.&fields=id").json() == expected
+    assert client.get("/cards?level=1.0&fields=id").json() == expected
+    assert client.get("/cards?level=1.5&fields=id").json() == []
+    # only ASCII digits are numbers: a fullwidth "１" matches no level
+    assert client.get("/cards?level=\uff11&fields=id").json() == []
+    assert client.get("/cards?round=\uff11&fields=id").json() == []
+
+
+@pytest.mark.parametrize(
+    "query, status",
+    [("sort=effect", 422), ("fields=name,secret", 422), ("cursor=not-a-cursor", 400),
+     ("sort=level&cursor=WyJpZCIsMSwxXQ", 400),
+     # keys of the wrong type for the sort column: ["number",5,1], ["-level","3",1], ["id",1,"1"]
+     ("sort=number&cursor=WyJudW1iZXIiLDUsMV0", 400), ("sort=-level&cursor=WyItbGV2ZWwiLCIzIiwxXQ", 400),
+     ("cursor=WyJpZCIsMSwiMSJd", 400),
+     # ints outside int64: ["battle_power_1",10**30,1], ["id",1,10**30]
+     ("sort=battle_power_1&cursor=WyJiYXR0bGVfcG93ZXJfMSIsMTAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMCwxXQ", 400),
+     ("cursor=WyJpZCIsMSwxMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwXQ", 400)],
+)
+@pytest.mark.parametrize("engine", ["sqlite", "memory"])
+def test_pagination_parameter_validation(query, status, engine, monkeypatch):
+    """Unknown sort keys and fields, and foreign or malformed cursors, are rejected."""
+    import nebula_api
+    monkeypatch.setattr(nebula_api, "ENGINE", engine)
+    assert client.get(f"/cards?{query}").status_code == status
+
+
+@pytest.mark.parametrize(
+    "filters",
+    [
+        {"name": "Tiga"},
+        {"rarity": "rrr"},
+        {"level": "3"},
+        {"round": "2.0"},
+        {"level": "1."},
+        {"character_name": "zero"},
+        {"feature": "Kaiju"},
+        {"type": "Speed"},
+        {"publication_year": 2024},
+        {"number": "BP01"},
+        {"errata_enable": True},
+        {"rarity": "U", "feature": "Ultra", "limit": 5},
+        {"character_name": "Tiga", "sort": "battle_power_1"},
+        {"ranges": (("battle_power_1", 7000, None),)},
+        {"ranges": (("battle_power_ex", None, 8000),)},
+        {"ranges": (("publication_year", 2020, None),)},
+        {"ranges": (("level", 2, 3), ("battle_power_1", 7000, None))},
+        {"feature": "Kaiju", "ranges": (("round", 1, 2),), "sort": "level"},
+    ],
+)
+def test_card_filters_use_indexes(filters, monkeypatch):
+    """Every get_cards filter is answered through an index, never a full table scan."""
+    import nebula_api
+    captured = []
+    monkeypatch.setattr(nebula_api, "query_db", lambda query, params=(): captured.append((query, params)) or [])
+    nebula_api.select_cards(**filters)
+    query, params = captured[0]
+    with nebula_api.db_pool.connection() as conn:
+        plan = [row["detail"] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)]
+    assert not [step for step in plan if step.startswith("SCAN cards") and "INDEX" not in step], plan
+
+
+def test_cards_batch_resolves_deck_list_in_order():
+    """Batch lookups keep request order, drop duplicates and report misses."""
+    response = client.post("/cards/batch", json={
+        "numbers": ["BP02-010", "BP01-001", "BP01-001", "PR-001", "NOPE-999"],
+        "ids": [99999],
+    })
+    assert response.status_code == 200
+    body = response.json()
+    assert [card["number"] for card in body["cards"]] == ["BP02-010", "BP01-001", "(01)PR-001"]
+    assert body["cards"][1] == client.get("/card/BP01-001").json()
+    assert body["missing"] == ["NOPE-999", "99999"]
+
+
+@pytest.mark.parametrize("engine", ["sqlite", "memory"])
+def test_cards_batch_rejects_unbindable_ids_and_misses_blank_numbers(engine, monkeypatch):
+    """Ids outside int64 are a 422; blank numbers are missing, not a substring match of every card."""
+    import nebula_api
+    monkeypatch.setattr(nebula_api, "ENGINE", engine)
+    assert client.post("/cards/batch", json={"ids": [10 ** 20]}).status_code == 422
+    assert client.post("/cards/batch", json={"ids": [-(10 ** 20)]}).status_code == 422
+    body = client.post("/cards/batch", json={"numbers": ["", " ", "BP01-001"]}).json()
+    assert [card["number"] for card in body["cards"]] == ["BP01-001"]
+    assert body["missing"] == ["", " "]
+    deck = client.post("/decks/analyze", json={"cards": [{"number": ""}, {"number": "BP01-001"}]}).json()
+    assert (deck["total_cards"], deck["missing"]) == (1, [""])
+
+
+def test_cards_numbers_query_matches_batch(memory_engine):
+    """GET /cards?numbers= returns the batch result, with misses percent-encoded in a header."""
+    from urllib.parse import unquote
+    response = client.get("/cards?numbers=BP04-031,BP01-001,NOPE-999")
+    assert response.status_code == 200
+    assert [card["number"] for card in response.json()] == ["BP04-031", "BP01-001"]
+    assert response.headers["X-Missing-Cards"] == "NOPE-999"
+    unicode = client.get("/cards?numbers=テスト,BP01-001,A B")
+    assert unicode.status_code == 200
+    assert [unquote(n) for n in unicode.headers["X-Missing-Cards"].split(",")] == ["テスト", "A B"]
+    assert client.get("/cards?numbers=BP01-001&rarity=C").status_code == 422
+    assert client.post("/cards/batch", json={"ids": list(range(501))}).status_code == 422
+
+
+def test_db_executor_rejects_work_beyond_its_queue():
+    """Jobs beyond max_workers + max_queue fail fast instead of queueing."""
+    import asyncio
+    import threading
+    from db_executor import BoundedExecutor, Overloaded
+    executor = BoundedExecutor(max_workers=1, max_queue=1)
+    release = threading.Event()
+
+    async def burst():
+        running = [asyncio.ensure_future(executor.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded):
+            await executor.run(release.wait)
+        release.set()
+        return await asyncio.gather(*running)
+
+    assert asyncio.run(burst()) == [True, True]
+    assert executor.stats()["rejected"] == 1
+    assert executor.stats()["pending"] == 0
+
+
+def test_db_executor_holds_the_slot_of_a_cancelled_waiter_until_its_job_ends():
+    """Cancelling the awaiting request does not free the slot of a job still running."""
+    import asyncio
+    import threading
+    from db_executor import BoundedExecutor
+    executor = BoundedExecutor(max_workers=1, max_queue=0)
+    started, release = threading.Event(), threading.Event()
+
+    def job():
+        started.set()
+        release.wait()
+
+    async def cancel_waiter():
+        waiter = asyncio.ensure_future(executor.run(job))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return executor.stats()["pending"]
+
+    try:
+        assert asyncio.run(cancel_waiter()) == 1
+    finally:
+        release.set()
+    executor._executor.shutdown(wait=True)
+    assert executor.stats()["pending"] == 0
+
+
+def test_saturated_executor_returns_503_but_serves_cached(monkeypatch):
+    """A saturated executor sheds new queries with 503; cached responses still flow."""
+    import nebula_api
+    from db_executor import BoundedExecutor
+    assert client.get("/cards?rarity=RR&limit=2").status_code == 200
+    saturated = BoundedExecutor(max_workers=1, max_queue=0)
+    saturated.pending = saturated.capacity
+    monkeypatch.setattr(nebula_api, "db_executor", saturated)
+    response = client.get("/cards?rarity=RR&limit=3")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert client.get("/cards?rarity=RR&limit=2").status_code == 200
+
+
+def test_incremental_sync_applies_only_the_diff(tmp_path):
+    """The CSV diff is applied in place and matches a full rebuild."""
+    import csv
+    import shutil
+    import sqlite3
+    import update_card_db
+    db_file = str(tmp_path / "cards.db")
+    shutil.copy(update_card_db.DB_FILE, db_file)
+    with open(update_card_db.CSV_FILE, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    rows[0]["name"] = rows[0]["name"] + " (Alt)"
+    removed = rows.pop(1)
+    rows.append(dict(rows[2], id="99999", number="TEST-001"))
+    csv_file = tmp_path / "cards.csv"
+    with open(csv_file, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+    summary = update_card_db.sync(str(csv_file), db_file)
+    assert (summary["mode"], summary["inserted"], summary["updated"], summary["deleted"]) == ("incremental", 1, 1, 1)
+    rebuilt = update_card_db.sync(str(csv_file), str(tmp_path / "rebuilt.db"))
+    assert (rebuilt["mode"], rebuilt["inserted"], rebuilt["updated"]) == ("rebuild", len(rows), 0)
+    assert rebuilt["data_version"] == summary["data_version"]
+
+    with sqlite3.connect(db_file) as conn:
+        conn.execute("INSERT INTO cards_fts(cards_fts) VALUES('integrity-check')")
+        assert conn.execute("SELECT COUNT(*) FROM cards WHERE id = ?", (int(removed["id"]),)).fetchone()[0] == 0
+        assert conn.execute("SELECT mode, inserted, updated, deleted FROM sync_log ORDER BY id DESC").fetchone() == ("incremental", 1, 1, 1)
+
+    mtime = os.stat(db_file).st_mtime_ns
+    assert update_card_db.sync(str(csv_file), db_file)["updated"] == 0
+    assert os.stat(db_file).st_mtime_ns == mtime
+
+
+def test_running_worker_picks_up_synced_data(tmp_path, monkeypatch, memory_engine):
+    """A change to the database file is noticed by the next request and loaded, no restart."""
+    import shutil
+    import sqlite3
+    import nebula_api
+    from db_pool import ConnectionPool
+    db_copy = tmp_path / "cards.db"
+    shutil.copy(nebula_api.DB_PATH, db_copy)
+    monkeypatch.setattr(nebula_api, "DB_PATH", str(db_copy))
+    monkeypatch.setattr(nebula_api, "db_pool", ConnectionPool(db_copy))
+    before = get_after_reload("/cards?number=BP01-001")
+    assert before.json()[0]["name"] == "Ultraman Tiga"
+
+    with sqlite3.connect(db_copy) as conn:
+        conn.execute("UPDATE cards SET name = 'Ultraman Tiga (Reprint)' WHERE number = 'BP01-001'")
+        conn.execute("UPDATE meta SET value = 'reloaded' WHERE key = 'data_version'")
+    after = get_after_reload("/cards?number=BP01-001")
+    assert after.json()[0]["name"] == "Ultraman Tiga (Reprint)"
+    assert before.headers["X-Data-Version"] != after.headers["X-Data-Version"] == "reloaded"
+
+
+def test_card_changes_returns_the_sync_delta(tmp_path, monkeypatch):
+    """/cards/changes serves the ids a sync touched, or everything when too far behind."""
+    import csv
+    import shutil
+    import sqlite3
+    import nebula_api
+    import update_card_db
+    from db_pool import ConnectionPool
+    db_file = tmp_path / "cards.db"
+    shutil.copy(update_card_db.DB_FILE, db_file)
+    with open(update_card_db.CSV_FILE, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    rows[0]["name"] = rows[0]["name"] + " (Alt)"
+    removed = rows.pop(1)
+    rows.append(dict(rows[2], id="99999", number="TEST-001"))
+    csv_file = tmp_path / "cards.csv"
+    with open(csv_file, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    with sqlite3.connect(db_file) as conn:
+        before, before_version = conn.execute("SELECT id, data_version FROM sync_log ORDER BY id DESC").fetchone()
+    update_card_db.sync(str(csv_file), str(db_file))
+    monkeypatch.setattr(nebula_api, "DB_PATH", str(db_file))
+    monkeypatch.setattr(nebula_api, "db_pool", ConnectionPool(db_file))
+
+    for since in (before, before_version):
+        delta = get_after_reload(f"/cards/changes?since={since}").json()
+        assert (delta["version"], delta["full"]) == (before + 1, False)
+        assert delta["deleted"] == [int(removed["id"])]
+        assert [card["id"] for card in delta["cards"]] == sorted([int(rows[0]["id"]), 99999])
+        assert delta["cards"][0]["name"].endswith(" (Alt)")
+    assert client.get(f"/cards/changes?since={before + 1}").json()["cards"] == []
+    for since in (before - 1, before + 2, "unknown", "\u00b2", 10 ** 30):
+        full = client.get(f"/cards/changes?since={since}").json()
+        assert full["full"] and full["deleted"] == []
+        assert len(full["cards"]) == len(rows)
+    # a data version made of digits is looked up as one, not read as a sync id
+    with sqlite3.connect(db_file) as conn:
+        conn.execute("UPDATE sync_log SET data_version = ? WHERE id = ?", (str(before - 1), before))
+    nebula_api.response_cache.clear()
+    assert client.get(f"/cards/changes?since={before - 1}").json()["full"] is False
+
+    # a rebuild keeps the history and records its own diff
+    rows[0]["name"] = rows[0]["name"] + " 2"
+    with open(csv_file, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    rebuilt = update_card_db.sync(str(csv_file), str(db_file), force_rebuild=True)
+    assert (rebuilt["mode"], rebuilt["inserted"], rebuilt["updated"], rebuilt["deleted"]) == ("rebuild", 0, 1, 0)
+    with sqlite3.connect(db_file) as conn:
+        assert conn.execute("SELECT mode, inserted, updated, deleted FROM sync_log ORDER BY id DESC").fetchone() == ("rebuild", 0, 1, 0)
+    delta = get_after_reload(f"/cards/changes?since={before}").json()
+    assert (delta["version"], delta["full"]) == (before + 2, False)
+    assert [card["id"] for card in delta["cards"]] == sorted([int(rows[0]["id"]), 99999])
+
+
+def test_workers_map_the_synced_snapshot(tmp_path, monkeypatch, memory_engine):
+    """The memory engine maps the snapshot a sync wrote, and only for its data version."""
+    import shutil
+    import sqlite3
+    import nebula_api
+    import update_card_db
+    from card_snapshot import open_snapshot, snapshot_path
+    from card_store import CardStore
+    from db_pool import ConnectionPool
+    db_file = tmp_path / "cards.db"
+    shutil.copy(update_card_db.DB_FILE, db_file)
+    summary = update_card_db.sync(update_card_db.CSV_FILE, str(db_file))
+    mapped = open_snapshot(snapshot_path(db_file), summary["data_version"])
+    loaded = CardStore.from_sqlite(db_file)
+    assert mapped.rows(mapped.all_rows) == loaded.rows(loaded.all_rows)
+    assert mapped.select(feature="Kaiju", sort="battle_power_1", descending=True) == \
+        loaded.select(feature="Kaiju", sort="battle_power_1", descending=True)
+    assert open_snapshot(snapshot_path(db_file), "other-version") is None
+
+    monkeypatch.setattr(nebula_api, "DB_PATH", str(db_file))
+    monkeypatch.setattr(nebula_api, "db_pool", ConnectionPool(db_file))
+    assert get_after_reload("/cards?number=BP01-001").json()[0]["name"] == "Ultraman Tiga"
+    assert client.get("/debug/pool").json()["card_store"] == "snapshot"
+
+    # a database the snapshot does not belong to is loaded from the table
+    with sqlite3.connect(db_file) as conn:
+        conn.execute("UPDATE meta SET value = 'unsynced' WHERE key = 'data_version'")
+    assert get_after_reload("/cards?number=BP01-001").headers["X-Data-Version"] == "unsynced"
+    assert client.get("/debug/pool").json()["card_store"] == "sqlite"
+
+
+def test_committed_snapshot_matches_committed_database():
+    """Deployments built from git get a snapshot the memory engine can map."""
+    import sqlite3
+    import update_card_db
+    from card_snapshot import open_snapshot, snapshot_path
+    with sqlite3.connect(update_card_db.DB_FILE) as conn:
+        version = conn.execute("SELECT value FROM meta WHERE key = 'data_version'").fetchone()[0]
+    assert open_snapshot(snapshot_path(update_card_db.DB_FILE), version) is not None
+
+
+def test_reload_does_not_block_readers():
+    """A new snapshot loads in the background; every caller keeps the old one meanwhile."""
+    import threading
+    from data_reload import Reloader
+    stamp = {"value": 1}
+    loading = threading.Event()
+    release = threading.Event()
+
+    def load(current):
+        if current == 2:
+            loading.set()
+            release.wait()
+        return f"snapshot-{current}"
+
+    reloader = Reloader(lambda: stamp["value"], load)
+    assert reloader.current() == "snapshot-1"
+    stamp["value"] = 2
+    # the caller that notices the change is not the one loading it
+    assert reloader.current() == "snapshot-1"
+    assert loading.wait(2)
+    assert reloader.current() == "snapshot-1"
+    release.set()
+    reloader.wait()
+    assert reloader.current() == "snapshot-2"
+    assert reloader.stats()["reloads"] == 2
+
+
+def test_admin_reload_requires_token(monkeypatch):
+    """POST /admin/reload is hidden without a token and checks the bearer token."""
+    import nebula_api
+    monkeypatch.setattr(nebula_api, "ADMIN_TOKEN", None)
+    assert client.post("/admin/reload").status_code == 404
+    monkeypatch.setattr(nebula_api, "ADMIN_TOKEN", "s3cret")
+    assert client.post("/admin/reload", headers={"Authorization": "Bearer nope"}).status_code == 401
+    reloads = nebula_api.data_reloader.reloads
+    response = client.post("/admin/reload", headers={"Authorization": "Bearer s3cret"})
+    assert response.status_code == 200
+    assert response.json()["data_version"] == nebula_api.data_version()
+    assert nebula_api.data_reloader.reloads == reloads + 1
+
+
+def test_csv_loader_converts_by_declared_column_type(tmp_path):
+    """The stdlib loader types each field by the cards schema."""
+    import update_card_db
+    csv_file = tmp_path / "cards.csv"
+    csv_file.write_text(
+        "id,name,level,round,bundle_version,battle_power_1,errata_enable,flavor_text\n"
+        "7,Ultraman,3,3.0,07,,False,\n"
+        "8,Zetton,,,10,9000,True,\"Line one,\nline two\"\n",
+        encoding="utf-8",
+    )
+    columns, rows = update_card_db.load_csv(str(csv_file))
+    assert columns[:3] == ["id", "name", "level"]
+    assert list(rows) == [
+        (7, "Ultraman", 3, 3, "07", None, 0, None),
+        (8, "Zetton", None, None, "10", 9000, 1, "Line one,\nline two"),
+    ]
+
+
+def test_server_timing_and_metrics_endpoint():
+    """Requests report stage timings and land in per-route histograms."""
+    import nebula_api
+    nebula_api.response_cache.clear()
+    response = client.get("/card/BP04-031")
+    stages = {part.split(";")[0] for part in response.headers["Server-Timing"].split(", ")}
+    assert {"sql", "rows", "total"} <= stages
+    metrics = client.get("/metrics")
+    assert metrics.headers["content-type"].startswith("text/plain")
+    assert 'nebula_request_duration_seconds_count{route="/card/{card_id}",method="GET",status="200"}' in metrics.text
+    assert 'nebula_request_stage_seconds_bucket{route="/card/{card_id}",stage="sql",le="+Inf"}' in metrics.text
+    assert 'nebula_request_counts_sum{route="/card/{card_id}",counter="rows"}' in metrics.text
+
+
+def test_slow_request_profiler_dumps_collapsed_stacks(tmp_path):
+    """Requests above the threshold leave a collapsed-stack profile behind."""
+    import time
+    from fastapi import FastAPI
+    from metrics import MetricsMiddleware, Registry, SlowRequestProfiler, stage
+    slow_app = FastAPI()
+
+    @slow_app.get("/slow/{n}")
+    def slow(n: int):
+        with stage("work"):
+            time.sleep(n / 1000)
+        return {}
+
+    profiler = SlowRequestProfiler(threshold_ms=30, interval_ms=1, directory=tmp_path)
+    slow_app.add_middleware(MetricsMiddleware, registry=Registry(), profiler=profiler)
+    slow_client = TestClient(slow_app)
+    slow_client.get("/slow/1")
+    assert profiler.dumps == 0
+    slow_client.get("/slow/60")
+    [dump] = tmp_path.glob("*slow_n-*.folded")
+    assert "test_api.py:slow" in dump.read_text(encoding="utf-8")
+
+
+def test_responses_compressed_above_threshold():
+    """Large JSON is gzipped when accepted; small or unaccepted responses are not."""
+    from compression import negotiate
+    assert negotiate("br;q=0, gzip;q=0.5") == "gzip"
+    assert negotiate("gzip;q=0, *;q=0.1") is None
+    assert negotiate("identity") is None
+    plain = client.get("/cards?rarity=R", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    assert plain.headers["vary"] == "Accept-Encoding"
+    compressed = client.get("/cards?rarity=R", headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert int(compressed.headers["content-length"]) < len(plain.content)
+    assert compressed.content == plain.content
+    small = client.get("/cards?limit=1", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+
+
+def test_sync_time_responses_precompressed_once_per_version(monkeypatch):
+    """Full /cards, /stats and /llms.txt reuse their compressed bodies until the data changes."""
+    import nebula_api
+    for path in ("/cards", "/stats", "/llms.txt"):
+        client.get(path, headers={"Accept-Encoding": "gzip"})
+    builds = nebula_api.precompressed.builds
+    for path in ("/cards", "/stats", "/llms.txt"):
+        response = client.get(path, headers={"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+    assert nebula_api.precompressed.builds == builds
+    stats = client.get("/stats", headers={"Accept-Encoding": "gzip"})
+    assert stats.headers["etag"].endswith('-gzip"')
+    assert client.get("/stats", headers={"Accept-Encoding": "gzip", "If-None-Match": stats.headers["etag"]}).status_code == 304
+    monkeypatch.setattr(nebula_api, "data_version", lambda: "next-sync")
+    client.get("/stats", headers={"Accept-Encoding": "gzip"})
+    assert nebula_api.precompressed.builds == builds + 1
+
+
+def test_static_export_matches_api(tmp_path, monkeypatch):
+    """export_static.py writes API-identical, precompressed files and a manifest."""
+    import gzip
+    import json
+    import export_static
+    paths = export_static.api_paths("ultraman_cards.db")
+    assert ("/cards?rarity=RRR", "cards/rarity/RRR.json") in paths
+    subset = [p for p in paths if p[0] in ("/cards", "/stats", "/card/BP04-031", "/cards?character_name=ALIEN+BALTAN")]
+    monkeypatch.setattr(export_static, "api_paths", lambda _db: subset)
+    out = tmp_path / "static"
+    manifest = export_static.export(str(out))
+    assert set(manifest["files"]) == {p[0] for p in subset}
+    entry = manifest["files"]["/card/BP04-031"]
+    body = (out / entry["file"]).read_bytes()
+    assert body == client.get("/card/BP04-031").content
+    assert gzip.decompress((out / entry["encodings"]["gzip"]["file"]).read_bytes()) == body
+    assert (out / "cards/character_name/ALIEN%20BALTAN.json").exists()
+    assert json.loads((out / "manifest.json").read_text(encoding="utf-8"))["data_version"] == manifest["data_version"]
+    assert export_static.export(str(out)) is None
+
+
+def test_cards_facets_count_the_filtered_set():
+    """?facets= adds per-value counts over every matching card, not just the page."""
+    import sqlite3
+    response = client.get("/cards?feature=Ultra&limit=5&facets=rarity,level,errata_enable")
+    assert response.status_code == 200
+    body = response.json()
+    assert len(body["cards"]) == 5
+    conn = sqlite3.connect("ultraman_cards.db")
+    where = "WHERE feature LIKE '%Ultra%'"
+    assert body["total"] == conn.execute(f"SELECT COUNT(*) FROM cards {where}").fetchone()[0]
+    expected = dict(conn.execute(f"SELECT rarity, COUNT(*) FROM cards {where} AND rarity IS NOT NULL GROUP BY rarity").fetchall())
+    assert {f["value"]: f["count"] for f in body["facets"]["rarity"]} == expected
+    counts = [f["count"] for f in body["facets"]["level"]]
+    assert counts == sorted(counts, reverse=True)
+    assert all(isinstance(f["value"], str) for f in body["facets"]["level"])
+    assert {f["value"] for f in body["facets"]["errata_enable"]} <= {True, False}
+    conn.close()
+    assert client.get("/cards?facets=effect").status_code == 422
+
+
+@pytest.mark.parametrize("query, where", [
+    ("feature=Kaiju&bp1_min=7000&level_min=5&level_max=6", "feature LIKE '%Kaiju%' AND battle_power_1 >= 7000 AND level BETWEEN 5 AND 6"),
+    ("bp_ex_min=0&year_max=2000", "battle_power_ex >= 0 AND publication_year <= 2000"),
+    ("round_min=2&round_max=3&rarity=u", "round BETWEEN 2 AND 3 AND rarity = 'U' COLLATE NOCASE"),
+    ("year_min=2024&year_max=2023", "0"),
+    ("bp1_min=-99999999999999999999999&bp1_max=99999999999999999999999", "battle_power_1 IS NOT NULL"),
+    ("bp1_min=99999999999999999999", "0"),
+    ("bp1_max=-99999999999999999999", "0"),
+    ("year_min=100000000000000000000", "0"),
+])
+def test_cards_range_filters_match_sql(query, where, monkeypatch):
+    """Range bounds are inclusive, skip NULLs and give the same rows in both engines."""
+    import sqlite3
+    import nebula_api
+    conn = sqlite3.connect("ultraman_cards.db")
+    expected = [row[0] for row in conn.execute(f"SELECT id FROM cards WHERE {where} ORDER BY id")]
+    conn.close()
+    assert [card["id"] for card in client.get(f"/cards?{query}").json()] == expected
+    monkeypatch.setattr(nebula_api, "ENGINE", "memory")
+    nebula_api.response_cache.clear()
+    assert [card["id"] for card in client.get(f"/cards?{query}").json()] == expected
+    assert client.get(f"/cards/export?{query}&fields=id").text.count("\n") == len(expected)
+    nebula_api.response_cache.clear()
+
+
+def test_store_range_on_text_column_casts_like_sql():
+    """Text level values ("3.0") are compared as CAST(level AS INTEGER)."""
+    from card_store import CardStore, DictColumn, IntColumn
+    store = CardStore(["id", "level"], {
+        "id": IntColumn.from_values([1, 2, 3, 4]),
+        "level": DictColumn.from_values(["2.0", "3.0", None, "10"]),
+    })
+    assert [row["id"] for row in store.select(ranges=[("level", 3, None)])] == [2, 4]
+    assert [row["id"] for row in store.select(ranges=[("level", None, 3)])] == [1, 2]
+    assert store.between("id", 2, 3) == 0b0110
+    assert store.between("id", 5, None) == 0
+
+
+def test_deck_analysis_matches_row_by_row_totals():
+    """POST /decks/analyze weighs every aggregate by quantity; bulk keeps request order."""
+    import sqlite3
+    conn = sqlite3.connect("ultraman_cards.db")
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute("SELECT * FROM cards WHERE number NOT LIKE '%/%' ORDER BY id LIMIT 12").fetchall()
+    conn.close()
+    entries = [{"number": row["number"], "quantity": i % 4 + 1} for i, row in enumerate(rows)]
+    deck = {"name": "test", "cards": entries + [{"number": "NO-SUCH-CARD"}]}
+    response = client.post("/decks/analyze", json=deck)
+    assert response.status_code == 200
+    body = response.json()
+    quantities = [e["quantity"] for e in entries]
+    assert body["total_cards"] == sum(quantities)
+    assert body["missing"] == ["NO-SUCH-CARD"]
+    assert body["battle_power"]["battle_power_1"]["total"] == sum(
+        q * (row["battle_power_1"] or 0) for q, row in zip(quantities, rows))
+    features = {}
+    for q, row in zip(quantities, rows):
+        if row["feature"] is not None:
+            features[row["feature"]] = features.get(row["feature"], 0) + q
+    assert body["feature_distribution"] == features
+
+    bulk = client.post("/decks/analyze/bulk", json={"decks": [deck, {"name": "empty", "cards": []}]})
+    assert [d["name"] for d in bulk.json()["decks"]] == ["test", "empty"]
+    assert bulk.json()["decks"][0] == body
+    assert bulk.json()["decks"][1]["total_cards"] == 0
+    assert client.post("/decks/analyze", json={"cards": [{"number": "BP01-001", "quantity": 0}]}).status_code == 422
+
+
+def test_suggest_prefix_and_fuzzy_matches():
+    """/suggest completes word starts, ranks whole-value prefixes first and tolerates one typo."""
+    response = client.get("/suggest?q=tig&limit=5")
+    assert response.status_code == 200
+    suggestions = response.json()
+    assert suggestions[0] == {"value": "TIGA", "field": "character_name", "cards": suggestions[0]["cards"],
+                              "number": suggestions[0]["number"]}
+    assert any(s["value"] == "Glitter Tiga" for s in suggestions)
+    assert client.get("/suggest?q=BP05-00&limit=3").json()[0]["field"] == "number"
+    assert client.get("/suggest?q=zeton").json() == []
+    fuzzy = [s["value"] for s in client.get("/suggest?q=zeton&fuzzy=true").json()]
+    assert "ZETTON" in fuzzy
+    assert "TIGA" in [s["value"] for s in client.get("/suggest?q=tgia&fuzzy=true").json()]
+    assert client.get("/suggest?q=ti&limit=51").status_code == 422
+
+
+def test_suggest_index_rebuilt_per_snapshot(monkeypatch):
+    """The autocomplete index follows data reloads."""
+    import nebula_api
+    first = nebula_api.suggest_index()
+    assert nebula_api.suggest_index() is first
+    snapshot = nebula_api.DataSnapshot(("reloaded",), "next-sync")
+    monkeypatch.setattr(nebula_api, "data_snapshot", lambda: snapshot)
+    assert nebula_api.suggest_index() is not first
+
+
+def test_cards_export_streams_every_format():
+    """/cards/export streams the /cards results as NDJSON, CSV and gzipped JSON lines."""
+    import csv
+    import gzip
+    import io
+    import json
+    expected = client.get("/cards?feature=Kaiju&sort=-battle_power_1").json()
+    response = client.get("/cards/export?feature=Kaiju&sort=-battle_power_1")
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in response.content.splitlines()] == expected
+    packed = client.get("/cards/export?format=jsonl.gz&feature=Kaiju&sort=-battle_power_1")
+    assert packed.headers["content-disposition"] == 'attachment; filename="cards.jsonl.gz"'
+    assert [json.loads(line) for line in gzip.decompress(packed.content).splitlines()] == expected
+    text = client.get("/cards/export?format=csv&feature=Kaiju&sort=-battle_power_1&fields=number,level").text
+    rows = list(csv.DictReader(io.StringIO(text)))
+    assert [(r["number"], r["level"]) for r in rows] == [(c["number"], c["level"] or "") for c in expected]
+    assert client.get("/cards/export?format=xml").status_code == 422
+
+
+def test_cards_export_without_matches():
+    """An empty export is still a valid file: the CSV header, an empty NDJSON, an empty gzip stream."""
+    import gzip
+    empty = client.get("/cards/export?format=csv&name=zzzzqqq&fields=number,name")
+    assert empty.status_code == 200
+    assert empty.text == "number,name\r\n"
+    assert client.get("/cards/export?format=csv&name=zzzzqqq").text.startswith("id,")
+    assert client.get("/cards/export?name=zzzzqqq").content == b""
+    assert gzip.decompress(client.get("/cards/export?format=jsonl.gz&name=zzzzqqq").content) == b""
+
+
+def test_cards_export_disconnect_mid_batch_releases_connection(monkeypatch):
+    """A client leaving while a batch is read still gets the connection back to the pool."""
+    import asyncio
+    import time
+    import nebula_api
+    started = []
+
+    def slow_batches(**_kwargs):
+        with nebula_api.db_pool.connection():
+            for i in range(5):
+                started.append(i)
+                time.sleep(0.1)
+                yield [{"id": 1}]
+
+    monkeypatch.setattr(nebula_api, "iter_card_batches", slow_batches)
+
+    async def disconnect_mid_stream():
+        sent = asyncio.Event()
+        scope = {"type": "http", "http_version": "1.1", "method": "GET", "scheme": "http",
+                 "path": "/cards/export", "raw_path": b"/cards/export", "query_string": b"",
+                 "root_path": "", "headers": [], "client": ("test", 1), "server": ("test", 80)}
+        messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await sent.wait()
+            # leave while the second batch is being read
+            await asyncio.sleep(0.05)
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                sent.set()
+
+        await nebula_api.app(scope, receive, send)
+
+    asyncio.run(disconnect_mid_stream())
+    deadline = time.time() + 2
+    while nebula_api.db_pool.stats()["in_use"] and time.time() < deadline:
+        time.sleep(0.02)
+    assert nebula_api.db_pool.stats()["in_use"] == 0
+    assert len(started) < 5
+
+
+def test_cards_export_reads_in_batches(monkeypatch):
+    """Rows are fetched EXPORT_BATCH at a time and encoded one batch per chunk."""
+    import nebula_api
+    monkeypatch.setattr(nebula_api, "EXPORT_BATCH", 100)
+    batches = list(nebula_api.iter_card_batches(columns=("id",)))
+    assert {len(b) for b in batches[:-1]} == {100}
+    total = client.get("/stats").json()["total_cards"]
+    assert sum(len(b) for b in batches) == total
+    chunks = list(nebula_api.export_chunks("ndjson", None, nebula_api.iter_card_batches(columns=("id",))))
+    assert len(chunks) == len(batches)
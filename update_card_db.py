@@ -1,37 +1,44 @@
+"""
+Sync ultraman_cards.db with ultraman_cards.csv.
+
+By default the sync is incremental: the CSV is staged into a temporary table,
+diffed against ``cards`` by id using a content hash per row, and only the
+inserted/updated/deleted rows (plus the derived FTS index, stats snapshot and
+data version) are written, in a single transaction.  Readers see either the
+old or the new data, never a half-filled table, and a sync that changes
+nothing does not write to the file at all.  Each applied sync is recorded in
+``sync_log``, and the ids it inserted/updated/deleted in ``card_changes``
+(the /cards/changes feed, kept for the last CHANGE_HISTORY syncs).
+
+A database without the current schema (or ``--rebuild``) is built from
+scratch in a temporary file that atomically replaces the old one; the sync
+history is carried over and the rebuild is diffed against the old rows.
+
+Every sync also writes ``ultraman_cards.snap`` (card_snapshot.py), the
+binary snapshot the API workers memory-map, before the new database
+becomes visible.
+
+    python update_card_db.py [--csv ultraman_cards.csv] [--db ultraman_cards.db] [--rebuild]
+"""
+import argparse
+import csv
+import hashlib
+import os
+import re
 import sqlite3
-import pandas as pd
+from datetime import datetime, timezone
+from itertools import islice
+
+from card_snapshot import snapshot_path, snapshot_version, write_snapshot
+from card_stats import write_stats_table
+from card_store import CardStore
 
 # === CONFIGURATION ===
 CSV_FILE = "ultraman_cards.csv"       # Update this if the file name changes
 DB_FILE = "ultraman_cards.db"             # Output database file name
+CHANGE_HISTORY = 90                   # Syncs whose per-card changes are kept for /cards/changes
 
-# === LOAD CSV ===
-print(f"Loading CSV: {CSV_FILE}")
-df = pd.read_csv(CSV_FILE)
-
-# === CLEAN DATA ===
-# Replace NaN / Null values in all battle_power columns with 0, cast as int
-# battle_cols = ['battle_power_1', 'battle_power_2', 'battle_power_3', 'battle_power_4' 'battle_power_ex']
-# for col in battle_cols:
-#     if col in df.columns:
-#         df[col] = df[col].fillna(0).astype(int)
-
-# # Convert key numeric columns to integers where possible
-# numeric_cols = ['level', 'bundle_version', 'publication_year']
-# for col in numeric_cols:
-#     if col in df.columns:
-#         df[col] = df[col].fillna(0).astype(int)
-
-# === CREATE DATABASE ===
-print(f"Creating database: {DB_FILE}")
-conn = sqlite3.connect(DB_FILE)
-cursor = conn.cursor()
-
-# Drop and recreate table
-cursor.execute("DROP TABLE IF EXISTS cards")
-
-cursor.execute("""
-CREATE TABLE cards (
+CARD_COLUMNS = """
     id INTEGER PRIMARY KEY,
     name TEXT,
     ruby TEXT,
@@ -40,8 +47,8 @@ CREATE TABLE cards (
     rarity TEXT,
     type TEXT,
     feature TEXT,
-    level TEXT,
-    round TEXT,
+    level INTEGER,
+    round INTEGER,
     battle_power_1 INTEGER,
     battle_power_2 INTEGER,
     battle_power_3 INTEGER,
@@ -63,14 +70,383 @@ CREATE TABLE cards (
     errata_enable BOOLEAN,
     errata_url TEXT,
     display_card_bundle_names TEXT
-);
-""")
+"""
+
+# Every get_cards filter can use one of these: equality lookups and range
+# filters directly, and substring (LIKE '%x%') filters by scanning the small
+# covering index for the matching distinct values and then looking those up.
+CARD_INDEXES = """
+CREATE INDEX idx_cards_name ON cards(name);
+CREATE INDEX idx_cards_rarity ON cards(rarity COLLATE NOCASE);
+CREATE INDEX idx_cards_level ON cards(level);
+CREATE INDEX idx_cards_round ON cards(round);
+CREATE INDEX idx_cards_character_name ON cards(character_name);
+CREATE INDEX idx_cards_feature ON cards(feature);
+CREATE INDEX idx_cards_type ON cards(type);
+CREATE INDEX idx_cards_publication_year ON cards(publication_year);
+CREATE INDEX idx_cards_battle_power_1 ON cards(battle_power_1);
+CREATE INDEX idx_cards_battle_power_2 ON cards(battle_power_2);
+CREATE INDEX idx_cards_battle_power_3 ON cards(battle_power_3);
+CREATE INDEX idx_cards_battle_power_4 ON cards(battle_power_4);
+CREATE INDEX idx_cards_battle_power_ex ON cards(battle_power_ex);
+CREATE INDEX idx_cards_number ON cards(number);
+CREATE INDEX idx_cards_errata ON cards(id) WHERE errata_enable = 1;
+"""
+
+FTS_COLUMNS = ["name", "ruby", "effect", "flavor_text"]
+
+INSERT_BATCH = 500
+
+
+# === LOAD CSV ===
+# Each CSV field is converted by the declared type of its column, so values
+# are stored exactly as the schema says: empty fields become NULL, INTEGER
+# columns hold ints (never "3.0"-style floats) and TEXT columns keep the
+# text as written (e.g. bundle_version "07").
+def to_int(value):
+    return int(value) if value.lstrip("+-").isdigit() else int(float(value))
+
+def to_bool(value):
+    return 1 if value.strip().lower() in ("true", "1") else 0
+
+CONVERTERS = {"INTEGER": to_int, "BOOLEAN": to_bool, "TEXT": str}
+
+COLUMN_TYPES = dict(re.findall(r"^\s*(\w+) (\w+)", CARD_COLUMNS, re.MULTILINE))
+
+
+def load_csv(csv_file):
+    """Column names and a stream of typed row tuples from the CSV."""
+    print(f"Loading CSV: {csv_file}")
+    f = open(csv_file, newline="", encoding="utf-8")
+    reader = csv.reader(f)
+    columns = next(reader)
+    unknown = [c for c in columns if c not in COLUMN_TYPES]
+    if unknown:
+        f.close()
+        raise ValueError(f"Unknown CSV columns: {', '.join(unknown)}")
+    converters = [CONVERTERS[COLUMN_TYPES[c]] for c in columns]
+
+    def rows():
+        with f:
+            for record in reader:
+                yield tuple(convert(value) if value != "" else None for convert, value in zip(converters, record))
+
+    return columns, rows()
+
+
+# === SCHEMA ===
+def expected_columns():
+    probe = sqlite3.connect(":memory:")
+    try:
+        probe.execute(f"CREATE TABLE cards ({CARD_COLUMNS})")
+        return probe.execute("PRAGMA table_info(cards)").fetchall()
+    finally:
+        probe.close()
+
+
+def has_current_schema(conn):
+    """True if ``cards`` (and its indexes and FTS table) match this script."""
+    if conn.execute("PRAGMA table_info(cards)").fetchall() != expected_columns():
+        return False
+    names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+    return "cards_fts" in names and "idx_cards_errata" in names
+
+
+def missing_indexes(conn):
+    """CARD_INDEXES statements whose index the database does not have yet."""
+    names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    return [statement.strip() for statement in CARD_INDEXES.split(";")
+            if statement.strip() and statement.split()[2] not in names]
+
+
+def insert_rows(conn, table, columns, rows):
+    """Insert ``rows`` in batches of INSERT_BATCH; returns the row count."""
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    count = 0
+    rows = iter(rows)
+    while batch := list(islice(rows, INSERT_BATCH)):
+        conn.executemany(sql, batch)
+        count += len(batch)
+    return count
+
+
+def row_hashes(conn, table):
+    """Content hash of every row of ``table``, keyed by id."""
+    return {
+        row[0]: hashlib.sha256(repr(row).encode("utf-8")).digest()
+        for row in conn.execute(f"SELECT * FROM {table} ORDER BY id")
+    }
+
+
+# === FULL-TEXT SEARCH INDEX ===
+# External-content FTS5 table over the searchable text columns. The trigram
+# tokenizer (SQLite >= 3.34) gives substring matching like LIKE '%q%', so
+# partial words such as "Gai" still match; older SQLite builds fall back to
+# unicode61 word/prefix matching.
+def fts5_tokenizer():
+    probe = sqlite3.connect(":memory:")
+    try:
+        probe.execute("CREATE VIRTUAL TABLE probe USING fts5(x, tokenize='trigram')")
+        return "trigram"
+    except sqlite3.OperationalError:
+        return "unicode61 remove_diacritics 2"
+    finally:
+        probe.close()
+
+
+def create_fts(conn):
+    tokenizer = fts5_tokenizer()
+    print(f"Building full-text index (tokenizer: {tokenizer})...")
+    conn.execute("DROP TABLE IF EXISTS cards_fts")
+    conn.execute(f"""
+    CREATE VIRTUAL TABLE cards_fts USING fts5(
+        {', '.join(FTS_COLUMNS)},
+        content='cards', content_rowid='id',
+        tokenize='{tokenizer}'
+    );
+    """)
+    conn.execute("INSERT INTO cards_fts(cards_fts) VALUES('rebuild')")
+
+
+def fts_remove(conn, ids):
+    """Drop the FTS entries of ``ids`` (must run before the rows change)."""
+    columns = ", ".join(FTS_COLUMNS)
+    conn.executemany(
+        f"INSERT INTO cards_fts(cards_fts, rowid, {columns}) SELECT 'delete', id, {columns} FROM cards WHERE id = ?",
+        [(card_id,) for card_id in ids],
+    )
+
+
+def fts_add(conn, ids):
+    columns = ", ".join(FTS_COLUMNS)
+    conn.executemany(
+        f"INSERT INTO cards_fts(rowid, {columns}) SELECT id, {columns} FROM cards WHERE id = ?",
+        [(card_id,) for card_id in ids],
+    )
+
+
+# === DERIVED TABLES ===
+def write_derived(conn):
+    """Stats snapshot and data version; returns the data version."""
+    # /stats serves this precomputed payload instead of aggregating per request
+    print("Computing stats snapshot...")
+    write_stats_table(conn)
+
+    # Content hash of the cards table; the API keys ETags and caches on it, so
+    # a sync that changes nothing keeps every client cache valid.
+    digest = hashlib.sha256()
+    for row in conn.execute("SELECT * FROM cards ORDER BY id"):
+        digest.update(repr(row).encode("utf-8"))
+    data_version = digest.hexdigest()[:16]
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('data_version', ?)", (data_version,))
+    print(f"Data version: {data_version}")
+    return data_version
+
+
+SYNC_LOG_TABLE = """
+CREATE TABLE IF NOT EXISTS sync_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    synced_at TEXT NOT NULL,
+    data_version TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    inserted INTEGER NOT NULL,
+    updated INTEGER NOT NULL,
+    deleted INTEGER NOT NULL
+)
+"""
+
+
+def log_sync(conn, data_version, mode, inserted, updated, deleted):
+    """Append to sync_log; returns the new sync id."""
+    conn.execute(SYNC_LOG_TABLE)
+    cursor = conn.execute(
+        "INSERT INTO sync_log (synced_at, data_version, mode, inserted, updated, deleted) VALUES (?, ?, ?, ?, ?, ?)",
+        (datetime.now(timezone.utc).isoformat(timespec="seconds"), data_version, mode, inserted, updated, deleted),
+    )
+    return cursor.lastrowid
+
+
+CHANGES_TABLE = """
+CREATE TABLE IF NOT EXISTS card_changes (
+    sync_id INTEGER NOT NULL,
+    card_id INTEGER NOT NULL,
+    change TEXT NOT NULL,
+    PRIMARY KEY (sync_id, card_id)
+)
+"""
+
+
+def log_changes(conn, sync_id, inserted, updated, deleted):
+    """
+    Record which card ids sync ``sync_id`` inserted/updated/deleted, for the
+    /cards/changes feed. ``meta.changes_from`` is the first sync whose changes
+    are still recorded; history older than CHANGE_HISTORY syncs is pruned.
+    """
+    conn.execute(CHANGES_TABLE)
+    conn.executemany(
+        "INSERT OR REPLACE INTO card_changes (sync_id, card_id, change) VALUES (?, ?, ?)",
+        [(sync_id, card_id, change) for change, ids in (("inserted", inserted), ("updated", updated), ("deleted", deleted))
+         for card_id in ids],
+    )
+    row = conn.execute("SELECT value FROM meta WHERE key = 'changes_from'").fetchone()
+    changes_from = int(row[0]) if row else sync_id
+    oldest_kept = sync_id - CHANGE_HISTORY + 1
+    if changes_from < oldest_kept:
+        conn.execute("DELETE FROM card_changes WHERE sync_id < ?", (oldest_kept,))
+        changes_from = oldest_kept
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('changes_from', ?)", (str(changes_from),))
+
+
+def carry_over_history(conn, old_db_file):
+    """
+    Copy sync_log, card_changes and changes_from from the database a rebuild
+    replaces, so the change feed survives it. Returns the old row hashes to
+    diff against, or None when there is no readable old database.
+    """
+    if not os.path.exists(old_db_file):
+        return None
+    conn.execute("ATTACH DATABASE ? AS old", (old_db_file,))
+    try:
+        tables = {row[0] for row in conn.execute("SELECT name FROM old.sqlite_master WHERE type = 'table'")}
+        if "cards" not in tables:
+            return None
+        if "sync_log" in tables:
+            conn.execute(SYNC_LOG_TABLE)
+            conn.execute("INSERT INTO sync_log SELECT * FROM old.sync_log")
+        if "card_changes" in tables:
+            conn.execute(CHANGES_TABLE)
+            conn.execute("INSERT INTO card_changes SELECT * FROM old.card_changes")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute("INSERT INTO meta (key, value) SELECT key, value FROM old.meta WHERE key = 'changes_from'")
+        return row_hashes(conn, "old.cards")
+    except sqlite3.DatabaseError:
+        return None
+    finally:
+        conn.commit()
+        conn.execute("DETACH DATABASE old")
+
+
+def write_card_snapshot(conn, db_file, data_version):
+    """Write the mapped snapshot of the cards visible on ``conn`` next to ``db_file``."""
+    path = snapshot_path(db_file)
+    print(f"Writing snapshot: {path}")
+    write_snapshot(CardStore.from_connection(conn), path, data_version)
+
+
+# === FULL REBUILD ===
+def rebuild(db_file, columns, rows):
+    """Build a fresh database next to ``db_file`` and atomically swap it in."""
+    tmp_file = db_file + ".tmp"
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    print(f"Creating database: {tmp_file}")
+    conn = sqlite3.connect(tmp_file)
+    try:
+        conn.execute(f"CREATE TABLE cards ({CARD_COLUMNS})")
+        old_hashes = carry_over_history(conn, db_file)
+        print("Inserting card records...")
+        count = insert_rows(conn, "cards", columns, rows)
+        print("Creating indexes...")
+        conn.executescript(CARD_INDEXES)
+        create_fts(conn)
+        data_version = write_derived(conn)
+        changes = None
+        inserted, updated, deleted = count, 0, 0
+        if old_hashes is not None:
+            # the change feed continues across the rebuild, counted against the old rows
+            new_hashes = row_hashes(conn, "cards")
+            changes = (
+                sorted(new_hashes.keys() - old_hashes.keys()),
+                sorted(i for i in new_hashes.keys() & old_hashes.keys() if new_hashes[i] != old_hashes[i]),
+                sorted(old_hashes.keys() - new_hashes.keys()),
+            )
+            inserted, updated, deleted = map(len, changes)
+        sync_id = log_sync(conn, data_version, "rebuild", inserted, updated, deleted)
+        if changes is not None:
+            log_changes(conn, sync_id, *changes)
+        conn.commit()
+        write_card_snapshot(conn, db_file, data_version)
+    finally:
+        conn.close()
+    os.replace(tmp_file, db_file)
+    return {"mode": "rebuild", "inserted": inserted, "updated": updated, "deleted": deleted, "data_version": data_version}
+
+
+# === INCREMENTAL SYNC ===
+def diff_sync(conn, columns, rows, db_file):
+    """Apply the CSV as inserts/updates/deletes inside one transaction."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # indexes added to CARD_INDEXES since the database was built
+        added = missing_indexes(conn)
+        for statement in added:
+            print(f"Creating index: {statement.split()[2]}")
+            conn.execute(statement)
+        conn.execute(f"CREATE TEMP TABLE cards_incoming ({CARD_COLUMNS})")
+        insert_rows(conn, "temp.cards_incoming", columns, rows)
+        incoming = row_hashes(conn, "temp.cards_incoming")
+        current = row_hashes(conn, "main.cards")
+
+        inserted = sorted(incoming.keys() - current.keys())
+        deleted = sorted(current.keys() - incoming.keys())
+        updated = sorted(i for i in incoming.keys() & current.keys() if incoming[i] != current[i])
+
+        data_version = None
+        if inserted or updated or deleted:
+            fts_remove(conn, updated + deleted)
+            conn.executemany("DELETE FROM cards WHERE id = ?", [(i,) for i in deleted])
+            conn.executemany(
+                "INSERT OR REPLACE INTO main.cards SELECT * FROM temp.cards_incoming WHERE id = ?",
+                [(i,) for i in inserted + updated],
+            )
+            fts_add(conn, inserted + updated)
+            data_version = write_derived(conn)
+            sync_id = log_sync(conn, data_version, "incremental", len(inserted), len(updated), len(deleted))
+            log_changes(conn, sync_id, inserted, updated, deleted)
+            # written before COMMIT so the new data never shows without it
+            write_card_snapshot(conn, db_file, data_version)
+        conn.execute("DROP TABLE temp.cards_incoming")
+        conn.execute("COMMIT" if data_version or added else "ROLLBACK")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    if data_version is None:
+        data_version = conn.execute("SELECT value FROM meta WHERE key = 'data_version'").fetchone()[0]
+        if snapshot_version(snapshot_path(db_file)) != data_version:
+            write_card_snapshot(conn, db_file, data_version)
+    return {
+        "mode": "incremental",
+        "inserted": len(inserted),
+        "updated": len(updated),
+        "deleted": len(deleted),
+        "data_version": data_version,
+    }
+
+
+def sync(csv_file=CSV_FILE, db_file=DB_FILE, force_rebuild=False):
+    """Bring ``db_file`` in line with ``csv_file``; returns a change summary."""
+    columns, rows = load_csv(csv_file)
+    if not force_rebuild and os.path.exists(db_file):
+        conn = sqlite3.connect(db_file, isolation_level=None)
+        try:
+            if has_current_schema(conn):
+                return diff_sync(conn, columns, rows, db_file)
+            print("Schema changed, rebuilding...")
+        finally:
+            conn.close()
+    return rebuild(db_file, columns, rows)
 
-# === INSERT DATA ===
-print("Inserting card records...")
-df.to_sql('cards', conn, if_exists='append', index=False)
 
-conn.commit()
-conn.close()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--csv", default=CSV_FILE)
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--rebuild", action="store_true", help="rebuild the database from scratch")
+    args = parser.parse_args()
 
-print(f"Database '{DB_FILE}' successfully rebuilt and populated with {len(df)} cards.")
+    summary = sync(args.csv, args.db, args.rebuild)
+    print(
+        f"Database '{args.db}' synced ({summary['mode']}): {summary['inserted']} inserted, "
+        f"{summary['updated']} updated, {summary['deleted']} deleted; data version {summary['data_version']}."
+    )